@@ -0,0 +1,317 @@
+# Measures throughput, round-trip latency and handshake rate against a
+# local wsaio server over TCP (127.0.0.1) and Unix sockets.
+# Run from the repository root with: python -m benchmarks.loopback [--json FILE]
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import wsaio
+from wsaio import WebSocketOpcode
+
+SIZES = {
+    'tiny': 8,
+    '125B': 125,
+    '64KiB': 64 * 1024,
+    '16MiB': 16 * 1024 * 1024,
+}
+
+# Every throughput run sends about this much data, within the message limits
+RUN_BYTES = 64 * 1024 * 1024
+MIN_MESSAGES = 4
+MAX_MESSAGES = 20000
+
+# Fragmented messages are sent as this many frames
+FRAGMENTS = 4
+
+LATENCY_SIZE = 125
+LATENCY_MESSAGES = 2000
+
+HANDSHAKE_DURATION = 2.0
+
+
+class BenchServerClient(wsaio.WebSocketServerClient):
+    # Counts (sink) or sends (source) messages and echoes binary messages
+    # prefixed with "echo". A ping from the client is answered after every
+    # message received before it, which ends a sink run.
+    def ws_connected(self):
+        self.received = 0
+
+    def ws_text_received(self, data):
+        if data.startswith('source '):
+            _, count, size, opcode, fragmented = data.split()
+            self.loop.create_task(
+                self.source(int(count), int(size), WebSocketOpcode(int(opcode)), fragmented == '1')
+            )
+        else:
+            self.received += 1
+
+    def ws_binary_received(self, data):
+        if data[:4] == b'echo':
+            self.loop.create_task(self.send_bytes(data, opcode=WebSocketOpcode.BINARY))
+        else:
+            self.received += 1
+
+    async def source(self, count, size, opcode, fragmented):
+        payload = make_payload(size, opcode)
+
+        for _ in range(count):
+            await send_message(self, payload, opcode, fragmented)
+
+
+class BenchClient(wsaio.WebSocketClient):
+    def __init__(self, loop=None):
+        super().__init__(loop)
+
+        self.received = 0
+        self.expected = None
+        self.waiter = None
+
+    def _message_received(self):
+        self.received += 1
+
+        if self.received == self.expected:
+            self.waiter.set_result(None)
+
+    def ws_text_received(self, data):
+        self._message_received()
+
+    def ws_binary_received(self, data):
+        self._message_received()
+
+    def ws_pong_received(self, data):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    def expect(self, count):
+        self.received = 0
+        self.expected = count
+        self.waiter = self.loop.create_future()
+        return self.waiter
+
+
+def make_payload(size, opcode):
+    if opcode is WebSocketOpcode.TEXT:
+        return b'a' * size
+
+    return os.urandom(size)
+
+
+async def send_message(client, payload, opcode, fragmented):
+    if fragmented:
+        await client.send_stream(
+            payload, opcode=opcode, fragment_size=max(1, -(-len(payload) // FRAGMENTS))
+        )
+    else:
+        await client.send_bytes(payload, opcode=opcode, wait=True)
+
+
+async def connect(server, transport):
+    client = BenchClient()
+
+    if transport == 'unix':
+        await client.connect('ws://localhost/', unix_path=server.path)
+    else:
+        await client.connect(f'ws://127.0.0.1:{server.port}/', port=server.port)
+
+    return client
+
+
+async def run_throughput(server, transport, size, opcode, masked, fragmented):
+    count = max(MIN_MESSAGES, min(MAX_MESSAGES, RUN_BYTES // size))
+    client = await connect(server, transport)
+
+    start = time.perf_counter()
+
+    if masked:
+        # Client to server, every frame is masked
+        payload = make_payload(size, opcode)
+
+        for _ in range(count):
+            await send_message(client, payload, opcode, fragmented)
+
+        waiter = client.expect(None)
+        await client.send_ping(b'done')
+    else:
+        # Server to client
+        waiter = client.expect(count)
+        await client.send_str(f'source {count} {size} {opcode.value} {int(fragmented)}')
+
+    await waiter
+    elapsed = time.perf_counter() - start
+
+    client.protocol.close()
+
+    return {
+        'messages': count,
+        'seconds': elapsed,
+        'messages_per_second': count / elapsed,
+        'mb_per_second': count * size / elapsed / (1024 * 1024),
+    }
+
+
+async def run_latency(server, transport):
+    client = await connect(server, transport)
+    payload = b'echo' + os.urandom(LATENCY_SIZE - 4)
+    samples = []
+
+    for _ in range(LATENCY_MESSAGES):
+        waiter = client.expect(1)
+        start = time.perf_counter()
+
+        await client.send_bytes(payload, opcode=WebSocketOpcode.BINARY)
+        await waiter
+
+        samples.append(time.perf_counter() - start)
+
+    client.protocol.close()
+    samples.sort()
+
+    return {
+        'messages': len(samples),
+        'size': LATENCY_SIZE,
+        'p50_ms': samples[len(samples) // 2] * 1000,
+        'p99_ms': samples[min(len(samples) - 1, len(samples) * 99 // 100)] * 1000,
+        'max_ms': samples[-1] * 1000,
+    }
+
+
+async def run_handshakes(server, transport):
+    count = 0
+    start = time.perf_counter()
+
+    while True:
+        client = await connect(server, transport)
+        client.protocol.close()
+        await client.wait_closed()
+
+        count += 1
+        elapsed = time.perf_counter() - start
+
+        if elapsed >= HANDSHAKE_DURATION:
+            break
+
+    return {
+        'handshakes': count,
+        'seconds': elapsed,
+        'handshakes_per_second': count / elapsed,
+    }
+
+
+async def start_servers(directory):
+    tcp = wsaio.WebSocketServer(BenchServerClient)
+    await tcp.listen('127.0.0.1', 0)
+    tcp.port = tcp.server.sockets[0].getsockname()[1]
+
+    unix = wsaio.WebSocketServer(BenchServerClient)
+    unix.path = os.path.join(directory, 'wsaio-bench.sock')
+    await unix.listen_unix(unix.path)
+
+    return {'tcp': tcp, 'unix': unix}
+
+
+def report(result):
+    name = result['benchmark']
+
+    if name == 'throughput':
+        print(
+            f'{result["transport"]:<5} {name:<11} {result["size"]:>6} {result["opcode"]:<6} '
+            f'{"masked" if result["masked"] else "plain":<7} '
+            f'{"fragmented" if result["fragmented"] else "whole":<10} '
+            f'{result["messages_per_second"]:>12.0f} msg/s {result["mb_per_second"]:>9.1f} MB/s',
+            file=sys.stderr
+        )
+    elif name == 'latency':
+        print(
+            f'{result["transport"]:<5} {name:<11} p50 {result["p50_ms"]:.3f} ms '
+            f'p99 {result["p99_ms"]:.3f} ms',
+            file=sys.stderr
+        )
+    else:
+        print(
+            f'{result["transport"]:<5} {name:<11} {result["handshakes_per_second"]:.0f}/s',
+            file=sys.stderr
+        )
+
+
+async def run(args):
+    results = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        servers = await start_servers(directory)
+
+        for transport in args.transports:
+            server = servers[transport]
+
+            for size_name in args.sizes:
+                for opcode in (WebSocketOpcode.BINARY, WebSocketOpcode.TEXT):
+                    for masked in (True, False):
+                        for fragmented in (False, True):
+                            result = {
+                                'benchmark': 'throughput', 'transport': transport,
+                                'size': size_name, 'bytes': SIZES[size_name],
+                                'opcode': opcode.name, 'masked': masked,
+                                'fragmented': fragmented,
+                            }
+                            result.update(await run_throughput(
+                                server, transport, SIZES[size_name], opcode, masked, fragmented
+                            ))
+                            results.append(result)
+                            report(result)
+
+            result = {'benchmark': 'latency', 'transport': transport}
+            result.update(await run_latency(server, transport))
+            results.append(result)
+            report(result)
+
+            result = {'benchmark': 'handshakes', 'transport': transport}
+            result.update(await run_handshakes(server, transport))
+            results.append(result)
+            report(result)
+
+        for server in servers.values():
+            server.close()
+            await server.wait_closed()
+
+    return results
+
+
+def main():
+    global RUN_BYTES, LATENCY_MESSAGES, HANDSHAKE_DURATION
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--json', metavar='FILE', help='write the results to FILE (- for stdout)')
+    parser.add_argument('--transports', nargs='+', choices=('tcp', 'unix'), default=['tcp', 'unix'])
+    parser.add_argument('--sizes', nargs='+', choices=tuple(SIZES), default=list(SIZES))
+    parser.add_argument('--quick', action='store_true', help='send less data per run')
+    args = parser.parse_args()
+
+    if args.quick:
+        RUN_BYTES //= 16
+        LATENCY_MESSAGES //= 10
+        HANDSHAKE_DURATION /= 4
+
+    started = time.time()
+    results = asyncio.run(run(args))
+
+    output = {
+        'started': started,
+        'python': platform.python_implementation() + ' ' + platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+    if args.json == '-':
+        json.dump(output, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, 'w') as fp:
+            json.dump(output, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
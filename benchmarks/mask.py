@@ -0,0 +1,58 @@
+# Measures the throughput of the payload masking engine.
+# Run from the repository root with: python -m benchmarks.mask
+import os
+import time
+
+from wsaio.mask import apply_mask, generate_mask
+
+SIZES = (16, 125, 1024, 16 * 1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024)
+MIN_DURATION = 0.5
+
+
+def naive_mask(data, mask):
+    data = bytearray(data)
+
+    for i in range(len(data)):
+        data[i] ^= mask[i % 4]
+
+    return data
+
+
+def measure(func, size):
+    iterations = 0
+    start = time.perf_counter()
+
+    while True:
+        func()
+        iterations += 1
+
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_DURATION:
+            return iterations * size / elapsed / (1024 * 1024)
+
+
+def main():
+    mask = generate_mask()
+
+    print(f'{"size":>10} {"apply_mask":>14} {"in place":>14} {"naive":>14}')
+
+    for size in SIZES:
+        data = os.urandom(size)
+        buffer = bytearray(data)
+        view = memoryview(buffer)
+
+        assert apply_mask(apply_mask(data, mask), mask) == data
+
+        copying = measure(lambda: apply_mask(data, mask), size)
+        in_place = measure(lambda: apply_mask(view, mask, buffer, 0), size)
+
+        if size <= 64 * 1024:
+            naive = f'{measure(lambda: naive_mask(data, mask), size):9.1f} MB/s'
+        else:
+            naive = 'skipped'
+
+        print(f'{size:>10} {copying:9.1f} MB/s {in_place:9.1f} MB/s {naive:>14}')
+
+
+if __name__ == '__main__':
+    main()
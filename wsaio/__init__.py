@@ -1,6 +1,16 @@
+from .broadcast import *
 from .client import *
 from .exceptions import *
+from .extensions import *
+from .fleet import *
+from .heartbeat import *
 from .http import *
+from .mask import *
+from .pool import *
 from .protocol import *
+from .reconnect import *
+from .serializers import *
+from .server import *
+from .stats import *
 from .utils import *
 from .websocket import *
@@ -0,0 +1,110 @@
+import asyncio
+
+from .protocol import WebSocketProtocolState
+from .websocket import WebSocketCloseCode, WebSocketFrame, WebSocketOpcode
+
+
+class PreparedFrame:
+    # A frame that is encoded and serialized once, the same immutable buffer
+    # is then written to every connection it is broadcast to. Prepared
+    # frames are never compressed, connections that negotiated
+    # permessage-deflate simply receive them with rsv1 unset.
+    __slots__ = ('frame', 'buffer')
+
+    def __init__(self, frame):
+        self.frame = frame
+        self.buffer = bytes(frame.serialize())
+
+    @classmethod
+    def from_bytes(cls, data, *, opcode=WebSocketOpcode.TEXT):
+        return cls(WebSocketFrame(opcode=opcode, data=data))
+
+    @classmethod
+    def from_str(cls, data, **kwargs):
+        return cls.from_bytes(data.encode(), **kwargs)
+
+
+def broadcast(clients, frame, *, max_buffer_size=None):
+    # Writes frame (a PreparedFrame) to every client without waiting for
+    # any of them, and returns the clients that were skipped because they
+    # are not connected, closing or paused, in the middle of sending a
+    # fragmented message, or because more than max_buffer_size bytes are
+    # waiting in their write buffer.
+    skipped = []
+    buffer = frame.buffer
+
+    for client in clients:
+        protocol = client.protocol
+
+        if (
+            protocol is None
+            or protocol.state not in (WebSocketProtocolState.IDLE, WebSocketProtocolState.PARSING)
+            or protocol._paused
+            or protocol._send_fragmented
+            or protocol._send_queue
+        ):
+            skipped.append(client)
+            continue
+
+        transport = protocol.transport
+
+        if transport.is_closing() or (
+            max_buffer_size is not None
+            and transport.get_write_buffer_size() + protocol._cork_size > max_buffer_size
+        ):
+            skipped.append(client)
+            continue
+
+        if protocol.stats is not None:
+            protocol.stats.frame_sent(frame.frame.opcode, len(frame.frame.data))
+
+        if client.masked:
+            # Every masked frame needs its own mask, so the client end of a
+            # connection can not share the buffer.
+            protocol._write((frame.frame.serialize(masked=True),))
+        else:
+            protocol._write((buffer,))
+
+    return skipped
+
+
+async def close_all(clients, code=WebSocketCloseCode.GOING_AWAY, reason=b'', *, timeout=None):
+    # Starts the close handshake on every client at once and waits until
+    # all of them are gone. Each connection is aborted once timeout (its
+    # close_timeout by default) has passed, so this returns within about
+    # timeout seconds regardless of how many connections there are.
+    frame = PreparedFrame(
+        WebSocketFrame(opcode=WebSocketOpcode.CLOSE, data=code.to_bytes(2, 'big') + reason)
+    )
+    waiters = []
+
+    for client in tuple(clients):
+        protocol = client.protocol
+
+        if protocol is None or protocol.transport is None:
+            continue
+
+        if (
+            protocol.state in (WebSocketProtocolState.IDLE, WebSocketProtocolState.PARSING)
+            and not protocol._close_sent and not protocol.transport.is_closing()
+        ):
+            # Sent here so that the frame is only serialized once, unless it
+            # has to wait for queued data frames like in start_close().
+            protocol._close_sent = True
+
+            if protocol._send_queue:
+                protocol._send_queue.append(frame.frame)
+            else:
+                if protocol.stats is not None:
+                    protocol.stats.frame_sent(WebSocketOpcode.CLOSE, len(frame.frame.data))
+
+                if client.masked:
+                    protocol._write((frame.frame.serialize(masked=True),))
+                else:
+                    protocol._write((frame.buffer,))
+
+        protocol.start_close(code, reason, timeout=timeout)
+        waiters.append(protocol._closed)
+
+    if waiters:
+        await asyncio.wait(waiters)
@@ -1,16 +1,68 @@
 import asyncio
 import base64
+import mmap
 import os
+import ssl
 from http import HTTPStatus
 from urllib.parse import ParseResult, urlparse, urlunparse
 
 from .exceptions import BrokenHandshakeError, WsaioError
+from .extensions import PerMessageDeflate, parse_extensions
+from .heartbeat import HeartbeatScheduler
 from .http import HTTPRequest, HTTPResponse
-from .protocol import WebSocketProtocol, WebSocketProtocolState
-from .websocket import WebSocketCloseCode, WebSocketFrame, WebSocketOpcode
+from .pool import BUFFER_POOL
+from .protocol import (
+    CLOSE_TIMEOUT,
+    BufferedWebSocketProtocol,
+    WebSocketProtocol,
+    WebSocketProtocolState,
+)
+from .serializers import JSON_SERIALIZER
+from .utils import noop_callback
+from .websocket import (
+    DATA_OPCODES,
+    FRAGMENT_SIZE,
+    MAX_MESSAGE_SIZE,
+    WebSocketCloseCode,
+    WebSocketFrame,
+    WebSocketFrameParser,
+    WebSocketOpcode,
+    get_accept_key,
+)
+
+
+class BaseWebSocketClient:
+    # The callbacks and send methods shared by WebSocketClient and
+    # WebSocketServerClient, masked is True for the client end.
+    masked = True
+
+    # The connection settings. WebSocketClient.connect() sets them on the
+    # client, WebSocketServerClient reads them from its WebSocketServer.
+    compression = None
+    receive_limits = None
+    cork_delay = None
+    close_timeout = CLOSE_TIMEOUT
+
+    collect_stats = False
+
+    # True for the loop's shared HeartbeatScheduler or a HeartbeatScheduler
+    heartbeat = None
+
+    zero_copy = False
+    max_frame_size = None
+    max_message_size = MAX_MESSAGE_SIZE
+
+    # The BufferPool receive buffers are borrowed from, None for a buffer per connection
+    buffer_pool = BUFFER_POOL
+
+    # Used by send_obj() and ws_object_received, see serializers.py
+    serializer = JSON_SERIALIZER
+
+    # See WebSocketFrameParser
+    offload_threshold = None
+    executor = None
+    message_transform = None
 
-
-class WebSocketClient:
     def __init__(self, loop=None):
         if loop is not None:
             self.loop = loop
@@ -19,164 +71,491 @@ class WebSocketClient:
 
         self.protocol = None
 
-        self._handshake_complete = self.loop.create_future()
+        # Only one send_stream() at a time, see WebSocketProtocol._write_frame()
+        self._stream_lock = None
 
-    async def connection_made(self, transport):
-        self.protocol.set_parser(HTTPResponse.parser(self.protocol))
-        self.protocol.state = WebSocketProtocolState.HANDSHAKING
+    def _create_protocol(self, protocol_class):
+        protocol = protocol_class(self)
 
-        result = ParseResult(
-            '', '', self.url.path or '/', self.url.params, self.url.query, self.url.fragment
-        )
+        if self.receive_limits is not None:
+            protocol.set_receive_limits(**self.receive_limits)
 
-        request = HTTPRequest(
-            method='GET',
-            path=urlunparse(result),
-            headers=self.headers,
-            body=b''
-        )
+        protocol.set_cork_delay(self.cork_delay)
 
-        await self.protocol.write(request.serialize())
+        if self.collect_stats:
+            protocol.enable_stats()
 
-    def http_response_received(self, response):
-        extra = {
-            'response': response,
-            'protocol': self
-        }
+        return protocol
 
-        expected_status = HTTPStatus.SWITCHING_PROTOCOLS
+    def _create_frame_parser(self):
+        return WebSocketFrameParser(
+            self.protocol, zero_copy=self.zero_copy, server_side=not self.masked,
+            max_frame_size=self.max_frame_size, max_message_size=self.max_message_size,
+            offload_threshold=self.offload_threshold, executor=self.executor,
+            transform=self.message_transform, serializer=self.serializer,
+            buffer_pool=self.buffer_pool
+        )
 
-        if response.status is not expected_status:
-            self._handshake_complete.set_exception(
-                BrokenHandshakeError(
-                    f'Server responsed with status code {response.status} '
-                    f'({response.phrase}), need status code {expected_status} '
-                    f'({expected_status.phrase}) to complete handshake. '
-                    f'Closing!',
-                    extra
-                )
-            )
-            return self.protocol.close()
+    def _start_heartbeat(self):
+        scheduler = self.heartbeat
 
-        connection = response.headers.getone(b'connection')
+        if scheduler is True:
+            scheduler = HeartbeatScheduler.get(self.loop)
 
-        if connection is None or connection.lower() != b'upgrade':
-            self._handshake_complete.set_exception(
-                BrokenHandshakeError(
-                    f'Server responded with "connection: {connection}", '
-                    f'need "connection: upgrade" to complete handshake. '
-                    f'Closing!',
-                    extra
-                )
-            )
-            return self.protocol.close()
+        if scheduler is not None:
+            scheduler.add(self.protocol)
 
-        upgrade = response.headers.getone(b'upgrade')
+    def batch(self):
+        return self.protocol.batch()
 
-        if upgrade is None or upgrade.lower() != b'websocket':
-            self._handshake_complete.set_exception(
-                BrokenHandshakeError(
-                    f'Server responded with "upgrade: {upgrade}", '
-                    f'need "upgrade: websocket" to complete handshake. '
-                    f'Closing!',
-                    extra
-                )
-            )
-            return self.protocol.close()
+    async def wait_closed(self):
+        await self.protocol.wait_closed()
 
-        self.protocol.state = WebSocketProtocolState.IDLE
-        self.protocol.set_parser(WebSocketFrame.parser(self.protocol))
+    async def close(self, code=WebSocketCloseCode.NORMAL_CLOSURE, reason=b'', *, timeout=None):
+        # Starts the close handshake and waits until the connection is gone,
+        # see WebSocketProtocol.start_close()
+        if self.protocol is None or self.protocol.transport is None:
+            return
 
-        self._handshake_complete.set_result(None)
+        self.protocol.start_close(code, reason, timeout=timeout)
+        await self.protocol.wait_closed()
 
-        self.protocol._run_callback('ws_connected')
+    def handshake_failed(self, exc):
+        pass
 
+    @noop_callback
     def data_received(self, data):
         pass
 
+    @noop_callback
     def connection_lost(self, exc):
         pass
 
+    @noop_callback
     def connection_closing(self, exc):
         pass
 
     async def parser_failed(self, exc):
         if exc is not None:
             if self.protocol.state is WebSocketProtocolState.HANDSHAKING:
-                self._handshake_complete.set_exception(exc)
+                self.handshake_failed(exc)
             else:
                 close_code = WebSocketCloseCode.NORMAL_CLOSURE
 
                 if isinstance(exc, WsaioError):
                     close_code = exc.get_extra('close_code', WebSocketCloseCode.NORMAL_CLOSURE)
 
-                await self.send_close(close_code, str(exc).encode())
+                # Control frame payloads are limited to 125 bytes, 2 of them for the code
+                reason = str(exc).encode()[:123].decode('utf-8', 'ignore').encode()
+                await self.send_close(close_code, reason)
 
         self.protocol.close(exc)
 
+    @noop_callback
     def ws_connected(self):
         pass
 
+    @noop_callback
     def ws_frame_received(self, frame):
         pass
 
+    @noop_callback
     def ws_binary_received(self, data):
         pass
 
+    @noop_callback
     def ws_text_received(self, data):
         pass
 
+    @noop_callback
+    def ws_fragment_received(self, opcode, data, fin):
+        pass
+
+    @noop_callback
+    def ws_object_received(self, obj):
+        pass
+
+    @noop_callback
     def ws_ping_received(self, data):
         pass
 
+    @noop_callback
     def ws_pong_received(self, data):
         pass
 
+    @noop_callback
     def ws_close_received(self, code, data):
         pass
 
     async def send_frame(self, frame, **kwargs):
-        await self.protocol.write(frame.serialize(masked=True), **kwargs)
+        await self.protocol.write_frame(frame, **kwargs)
+
+    def _create_frame(self, data, opcode):
+        compressed = False
+
+        if (
+            opcode in DATA_OPCODES
+            and self.compression in self.protocol.extensions
+            and len(data) >= self.compression.min_size
+        ):
+            data = self.compression.compress(data)
+            compressed = True
+
+        return WebSocketFrame(opcode=opcode, rsv1=compressed, data=data)
 
     def send_bytes(self, data, *, opcode=WebSocketOpcode.TEXT, **kwargs):
-        return self.send_frame(WebSocketFrame(opcode=opcode, data=data), **kwargs)
+        return self.send_frame(self._create_frame(data, opcode), **kwargs)
 
     def send_str(self, data, *args, **kwargs):
         return self.send_bytes(data.encode(), *args, **kwargs)
 
+    def send_obj(self, obj, **kwargs):
+        # The serializer's bytes are written as they are, without a str in between
+        return self.send_bytes(
+            self.serializer.dumps(obj), opcode=self.serializer.opcode, **kwargs
+        )
+
+    def send_json(self, obj, **kwargs):
+        return self.send_bytes(
+            JSON_SERIALIZER.dumps(obj), opcode=JSON_SERIALIZER.opcode, **kwargs
+        )
+
     def send_ping(self, *args, **kwrags):
         return self.send_bytes(*args, **kwrags, opcode=WebSocketOpcode.PING)
 
     def send_pong(self, *args, **kwrags):
         return self.send_bytes(*args, **kwrags, opcode=WebSocketOpcode.PONG)
 
-    async def send_close(self, code, data, *, drain=True):
-        data = code.to_bytes(2, 'big', signed=False) + data
+    async def send_stream(
+        self, data, *, opcode=WebSocketOpcode.BINARY, fragment_size=FRAGMENT_SIZE, **kwargs
+    ):
+        # Sends data as one message of fragment_size frames, waiting for the
+        # transport to drain after each one. data may be an async iterator,
+        # a file object or anything that supports the buffer protocol. Files
+        # are mmap()ed, so unmasked frames are sent straight from the mapping.
+        # Streamed messages are never compressed.
+        kwargs.setdefault('wait', True)
+
+        if hasattr(data, '__aiter__'):
+            fragments = self._iter_fragments(data, fragment_size)
+        elif hasattr(data, 'fileno') and hasattr(data, 'read'):
+            fragments = self._iter_file_fragments(data, fragment_size)
+        else:
+            fragments = self._iter_view_fragments(memoryview(data), fragment_size)
+
+        if self._stream_lock is None:
+            self._stream_lock = asyncio.Lock()
+
+        async with self._stream_lock:
+            await self._send_fragments(fragments, opcode, kwargs)
+
+    async def _send_fragments(self, fragments, opcode, kwargs):
+        pending = None
+        started = False
+
+        try:
+            async for fragment in fragments:
+                if pending is not None:
+                    frame = WebSocketFrame(opcode=opcode, fin=False, data=pending)
+                    started = True
+                    await self.send_frame(frame, **kwargs)
+                    opcode = WebSocketOpcode.CONTINUATION
+
+                pending = fragment
+        except BaseException:
+            # The message can not be completed and nothing else can be sent
+            # before it is, the connection is closed instead.
+            if started:
+                self.protocol.start_close(WebSocketCloseCode.INTERNAL_SERVER_ERROR)
+
+            raise
+
         await self.send_frame(
-            WebSocketFrame(opcode=WebSocketOpcode.CLOSE, data=data, drain=drain)
+            WebSocketFrame(opcode=opcode, data=pending if pending is not None else b''), **kwargs
         )
 
-    async def connect(self, url, *args, **kwargs):
-        self.sec_ws_key = base64.b64encode(os.urandom(16))
+    async def _iter_fragments(self, iterator, fragment_size):
+        async for chunk in iterator:
+            async for fragment in self._iter_view_fragments(memoryview(chunk), fragment_size):
+                yield fragment
+
+    async def _iter_view_fragments(self, view, fragment_size):
+        if view.format != 'B' or view.ndim != 1:
+            view = view.cast('B')
+
+        for start in range(0, len(view), fragment_size):
+            yield view[start:start + fragment_size]
+
+    async def _iter_file_fragments(self, fp, fragment_size):
+        try:
+            mapping = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            offset = fp.tell()
+        except (OSError, ValueError):
+            # Not a regular file (or an empty one)
+            while True:
+                chunk = fp.read(fragment_size)
+                if not chunk:
+                    return
+                yield chunk
+
+        view = memoryview(mapping)
+
+        try:
+            async for fragment in self._iter_view_fragments(view[offset:], fragment_size):
+                yield fragment
+        finally:
+            fp.seek(0, os.SEEK_END)
+
+            # The transport may still hold fragments, so the mapping is left to
+            # be closed by the garbage collector once they are written.
+            view.release()
+
+    async def send_close(self, code, data, *, drain=True):
+        # Starts the close handshake without waiting for it, nothing is sent
+        # if a CLOSE frame was sent already.
+        await self.protocol.write_close(code, data, wait=drain)
+
 
+class _ResumingContext:
+    # Wraps an SSLContext so that the transport asyncio creates resumes
+    # session, loop.create_connection() has no parameter for it.
+    def __init__(self, context, session):
+        self.context = context
+        self.session = session
+
+    def __getattr__(self, name):
+        return getattr(self.context, name)
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        return self.context.wrap_bio(
+            incoming, outgoing, server_side=server_side, server_hostname=server_hostname,
+            session=self.session
+        )
+
+
+class WebSocketClient(BaseWebSocketClient):
+    def __init__(self, loop=None):
+        super().__init__(loop)
+
+        self.url = None
+        self.ssl_session = None
+
+        self._handshake_complete = None
+        self._handshake_template = None
+
+    def handshake_failed(self, exc):
+        if not self._handshake_complete.done():
+            self._handshake_complete.set_exception(exc)
+
+    async def connection_made(self, transport):
+        self.protocol.set_parser(HTTPResponse.parser(self.protocol))
+        self.protocol.state = WebSocketProtocolState.HANDSHAKING
+
+        await self.protocol.write(
+            b''.join((
+                self._handshake_template, b'Sec-WebSocket-Key: ', self.sec_ws_key, b'\r\n\r\n'
+            ))
+        )
+
+    def http_response_received(self, response):
+        extra = {
+            'response': response,
+            'protocol': self
+        }
+
+        expected_status = HTTPStatus.SWITCHING_PROTOCOLS
+
+        if response.status is not expected_status:
+            self._handshake_complete.set_exception(
+                BrokenHandshakeError(
+                    f'Server responsed with status code {response.status} '
+                    f'({response.phrase}), need status code {expected_status} '
+                    f'({expected_status.phrase}) to complete handshake. '
+                    f'Closing!',
+                    extra
+                )
+            )
+            return self.protocol.close()
+
+        connection = response.headers.getone(b'connection')
+
+        if connection is None or connection.lower() != b'upgrade':
+            self._handshake_complete.set_exception(
+                BrokenHandshakeError(
+                    f'Server responded with "connection: {connection}", '
+                    f'need "connection: upgrade" to complete handshake. '
+                    f'Closing!',
+                    extra
+                )
+            )
+            return self.protocol.close()
+
+        upgrade = response.headers.getone(b'upgrade')
+
+        if upgrade is None or upgrade.lower() != b'websocket':
+            self._handshake_complete.set_exception(
+                BrokenHandshakeError(
+                    f'Server responded with "upgrade: {upgrade}", '
+                    f'need "upgrade: websocket" to complete handshake. '
+                    f'Closing!',
+                    extra
+                )
+            )
+            return self.protocol.close()
+
+        accept = response.headers.getone(b'sec-websocket-accept')
+
+        if accept != get_accept_key(self.sec_ws_key):
+            self._handshake_complete.set_exception(
+                BrokenHandshakeError(
+                    f'Server responded with "sec-websocket-accept: {accept}", '
+                    f'which does not match the key that was sent. '
+                    f'Closing!',
+                    extra
+                )
+            )
+            return self.protocol.close()
+
+        try:
+            self._negotiate_extensions(response, extra)
+        except BrokenHandshakeError as exc:
+            self._handshake_complete.set_exception(exc)
+            return self.protocol.close()
+
+        ssl_object = self.protocol.transport.get_extra_info('ssl_object')
+
+        if ssl_object is not None:
+            # Resumed by the next connect() or reconnect()
+            self.ssl_session = ssl_object.session
+
+        self.protocol.state = WebSocketProtocolState.IDLE
+        self.protocol.set_parser(self._create_frame_parser())
+        self._start_heartbeat()
+
+        self._handshake_complete.set_result(None)
+
+        self.protocol._run_callback('ws_connected')
+
+    def _negotiate_extensions(self, response, extra):
+        extensions = parse_extensions(response.headers.get(b'sec-websocket-extensions', ()))
+
+        for name, params in extensions:
+            if name != PerMessageDeflate.name or self.compression is None:
+                raise BrokenHandshakeError(
+                    f'Server responded with extension {name!r} which was not offered. '
+                    f'Closing!',
+                    extra
+                )
+
+            if self.compression in self.protocol.extensions:
+                raise BrokenHandshakeError(
+                    f'Server responded with extension {name!r} more than once. Closing!',
+                    extra
+                )
+
+            self.compression.accept(params, extra)
+            self.protocol.extensions.append(self.compression)
+
+    async def connect(self, url, *args, **kwargs):
         self.headers = kwargs.pop('headers', {})
+        self.zero_copy = kwargs.pop('zero_copy', False)
+        self.receive_limits = kwargs.pop('receive_limits', None)
+        self.cork_delay = kwargs.pop('cork_delay', None)
+        self.close_timeout = kwargs.pop('close_timeout', CLOSE_TIMEOUT)
+        self.heartbeat = kwargs.pop('heartbeat', None)
+        self.collect_stats = kwargs.pop('collect_stats', False)
+        self.max_frame_size = kwargs.pop('max_frame_size', None)
+        self.max_message_size = kwargs.pop('max_message_size', MAX_MESSAGE_SIZE)
+        self.offload_threshold = kwargs.pop('offload_threshold', None)
+        self.executor = kwargs.pop('executor', None)
+        self.message_transform = kwargs.pop('message_transform', None)
+        self.serializer = kwargs.pop('serializer', JSON_SERIALIZER)
+        self.buffer_pool = kwargs.pop('buffer_pool', BUFFER_POOL)
+
+        self.compression = kwargs.pop('compression', None)
+
+        if self.compression is True:
+            self.compression = PerMessageDeflate()
+
+        if self.compression is not None:
+            self.headers['Sec-WebSocket-Extensions'] = self.compression.offer()
+
+        if kwargs.pop('buffered', False):
+            self.protocol_class = BufferedWebSocketProtocol
+        else:
+            self.protocol_class = WebSocketProtocol
 
         self.url = urlparse(url)
         self.ssl = kwargs.pop('ssl', self.url.scheme == 'wss')
         self.port = kwargs.pop('port', 443 if self.ssl else 80)
 
+        # Connects to a Unix socket instead, the URL is then only used for the request
+        self.unix_path = kwargs.pop('unix_path', None)
+
+        if self.ssl is True:
+            # Sessions can only be resumed with the context that created them
+            self.ssl = ssl.create_default_context()
+
+        self.ssl_session = None
+
         self.headers.update({
             'Host': f'{self.url.hostname}:{self.port}',
             'Connection': 'Upgrade',
             'Upgrade': 'websocket',
-            'Sec-WebSocket-Key': self.sec_ws_key.decode(),
             'Sec-WebSocket-Version': 13
         })
 
-        kwargs.setdefault('ssl', self.ssl)
+        result = ParseResult(
+            '', '', self.url.path or '/', self.url.params, self.url.query, self.url.fragment
+        )
 
-        await self.loop.create_connection(
-            lambda: WebSocketProtocol(self), self.url.hostname, self.port, *args, **kwargs
+        request = HTTPRequest(
+            method='GET',
+            path=urlunparse(result),
+            headers=self.headers,
+            body=b''
         )
 
+        # Only the key changes between connections, it is added to the end
+        # of the serialized request (without its final CRLF) when it is sent.
+        self._handshake_template = request.serialize()[:-2]
+
+        self._connection_args = args
+        self._connection_kwargs = kwargs
+
+        await self.reconnect()
+
+    async def reconnect(self):
+        # Connects again with the arguments of the last connect() call,
+        # resuming the TLS session of the previous connection if possible.
+        if self.url is None:
+            raise WsaioError('reconnect() called before connect()', {'client': self})
+
+        if self.protocol is not None and self.protocol.state is not WebSocketProtocolState.CLOSED:
+            self.protocol.close()
+
+        if self.compression is not None:
+            self.compression.reset()
+
+        self.sec_ws_key = base64.b64encode(os.urandom(16))
+        self._handshake_complete = self.loop.create_future()
+
+        ssl_context = self.ssl
+
+        if ssl_context and self.ssl_session is not None:
+            ssl_context = _ResumingContext(ssl_context, self.ssl_session)
+
+        if self.unix_path is not None:
+            await self.loop.create_unix_connection(
+                lambda: self._create_protocol(self.protocol_class),
+                self.unix_path, *self._connection_args, ssl=ssl_context,
+                **self._connection_kwargs
+            )
+        else:
+            await self.loop.create_connection(
+                lambda: self._create_protocol(self.protocol_class),
+                self.url.hostname, self.port, *self._connection_args, ssl=ssl_context,
+                **self._connection_kwargs
+            )
+
         await self._handshake_complete
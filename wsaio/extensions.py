@@ -0,0 +1,242 @@
+import zlib
+
+from .exceptions import BrokenHandshakeError
+
+# Compressed messages are sent without the empty deflate block that ends a
+# sync flush, the receiving end has to put it back before decompressing.
+_EMPTY_BLOCK = b'\x00\x00\xff\xff'
+
+
+def parse_extensions(values):
+    # Parses Sec-WebSocket-Extensions header values into a list of
+    # (name, [(param, value or None), ...]) tuples.
+    extensions = []
+
+    for value in values:
+        if isinstance(value, bytes):
+            value = value.decode('latin-1')
+
+        for extension in value.split(','):
+            name, *params = (item.strip() for item in extension.split(';'))
+
+            if not name:
+                continue
+
+            parsed = []
+
+            for param in params:
+                key, sep, param_value = param.partition('=')
+                param_value = param_value.strip().strip('"') if sep else None
+                parsed.append((key.strip().lower(), param_value))
+
+            extensions.append((name.lower(), parsed))
+
+    return extensions
+
+
+def _parse_window_bits(value, extra):
+    if value is None or not value.isdigit() or not 9 <= int(value) <= 15:
+        # 8 is allowed by RFC 7692 but zlib cannot compress with it
+        raise BrokenHandshakeError(f'Invalid max_window_bits value: {value!r}', extra)
+
+    return int(value)
+
+
+class PerMessageDeflate:
+    name = 'permessage-deflate'
+
+    def __init__(
+        self, *, client_no_context_takeover=False, server_no_context_takeover=False,
+        client_max_window_bits=None, server_max_window_bits=None, min_size=128,
+        level=zlib.Z_DEFAULT_COMPRESSION, memory_level=8
+    ):
+        self.client_no_context_takeover = client_no_context_takeover
+        self.server_no_context_takeover = server_no_context_takeover
+        self.client_max_window_bits = client_max_window_bits
+        self.server_max_window_bits = server_max_window_bits
+
+        # Messages shorter than min_size are sent uncompressed
+        self.min_size = min_size
+        self.level = level
+        self.memory_level = memory_level
+
+        self.local_no_context_takeover = False
+        self.remote_no_context_takeover = False
+        self.local_max_window_bits = 15
+        self.remote_max_window_bits = 15
+
+        self._compressor = None
+        self._decompressor = None
+
+    def offer(self):
+        params = [self.name]
+
+        if self.client_no_context_takeover:
+            params.append('client_no_context_takeover')
+
+        if self.server_no_context_takeover:
+            params.append('server_no_context_takeover')
+
+        # Without a value this only tells the server that it may limit our window
+        if self.client_max_window_bits is None:
+            params.append('client_max_window_bits')
+        else:
+            params.append(f'client_max_window_bits={self.client_max_window_bits}')
+
+        if self.server_max_window_bits is not None:
+            params.append(f'server_max_window_bits={self.server_max_window_bits}')
+
+        return '; '.join(params)
+
+    def accept(self, params, extra):
+        # Configures the client side from the parameters of the server's response
+        seen = set()
+
+        # Every negotiated field is set, the instance may be reused across
+        # reconnects with a server that answers differently.
+        self.local_no_context_takeover = self.client_no_context_takeover
+        self.remote_no_context_takeover = False
+        self.local_max_window_bits = self.client_max_window_bits or 15
+        self.remote_max_window_bits = self.server_max_window_bits or 15
+
+        for key, value in params:
+            if key in seen:
+                raise BrokenHandshakeError(
+                    f'Server responded with duplicate {self.name} parameter {key!r}', extra
+                )
+
+            seen.add(key)
+
+            if key == 'server_no_context_takeover':
+                self.remote_no_context_takeover = True
+
+            elif key == 'client_no_context_takeover':
+                self.local_no_context_takeover = True
+
+            elif key == 'server_max_window_bits':
+                bits = _parse_window_bits(value, extra)
+
+                if bits > self.remote_max_window_bits:
+                    raise BrokenHandshakeError(
+                        f'Server responded with server_max_window_bits={bits}, '
+                        f'but only {self.remote_max_window_bits} was offered', extra
+                    )
+
+                self.remote_max_window_bits = bits
+
+            elif key == 'client_max_window_bits':
+                self.local_max_window_bits = min(
+                    self.local_max_window_bits, _parse_window_bits(value, extra)
+                )
+
+            else:
+                raise BrokenHandshakeError(
+                    f'Server responded with unknown {self.name} parameter {key!r}', extra
+                )
+
+    def negotiate(self, params):
+        # Configures the server side from one of the client's offers, returns
+        # the response to send or None if the offer can not be accepted.
+        offer = {}
+
+        for key, value in params:
+            if key in offer or key not in (
+                'client_no_context_takeover', 'server_no_context_takeover',
+                'client_max_window_bits', 'server_max_window_bits'
+            ):
+                return None
+
+            offer[key] = value
+
+        response = [self.name]
+
+        self.local_no_context_takeover = (
+            self.server_no_context_takeover or 'server_no_context_takeover' in offer
+        )
+        self.remote_no_context_takeover = (
+            self.client_no_context_takeover or 'client_no_context_takeover' in offer
+        )
+
+        if self.local_no_context_takeover:
+            response.append('server_no_context_takeover')
+
+        if self.remote_no_context_takeover:
+            response.append('client_no_context_takeover')
+
+        try:
+            self.local_max_window_bits = self.server_max_window_bits or 15
+
+            if 'server_max_window_bits' in offer:
+                bits = _parse_window_bits(offer['server_max_window_bits'], None)
+                self.local_max_window_bits = min(self.local_max_window_bits, bits)
+
+            if self.local_max_window_bits < 15:
+                response.append(f'server_max_window_bits={self.local_max_window_bits}')
+
+            self.remote_max_window_bits = 15
+
+            if 'client_max_window_bits' in offer:
+                if offer['client_max_window_bits'] is not None:
+                    self.remote_max_window_bits = _parse_window_bits(
+                        offer['client_max_window_bits'], None
+                    )
+
+                if self.client_max_window_bits is not None:
+                    self.remote_max_window_bits = min(
+                        self.remote_max_window_bits, self.client_max_window_bits
+                    )
+                    response.append(f'client_max_window_bits={self.remote_max_window_bits}')
+        except BrokenHandshakeError:
+            return None
+
+        return '; '.join(response)
+
+    def reset(self):
+        # Drops the compression contexts and the negotiated parameters, for
+        # reusing the extension on a new connection
+        self.local_no_context_takeover = False
+        self.remote_no_context_takeover = False
+        self.local_max_window_bits = 15
+        self.remote_max_window_bits = 15
+
+        self._compressor = None
+        self._decompressor = None
+
+    def compress(self, data):
+        if self._compressor is None:
+            self._compressor = zlib.compressobj(
+                self.level, zlib.DEFLATED, -self.local_max_window_bits, self.memory_level
+            )
+
+        data = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+        if self.local_no_context_takeover:
+            self._compressor = None
+
+        if data.endswith(_EMPTY_BLOCK):
+            data = data[:-4]
+
+        return data
+
+    def decompress(self, data, fin, max_length=0):
+        # Decompresses one frame of a message, fin marks the last one. At
+        # most max_length bytes are returned unless it is 0, the caller has
+        # to fail the connection if that many are.
+        if self._decompressor is None:
+            self._decompressor = zlib.decompressobj(-self.remote_max_window_bits)
+
+        data = self._decompressor.decompress(data, max_length)
+
+        if max_length and len(data) >= max_length:
+            return data
+
+        if fin:
+            if max_length:
+                max_length -= len(data)
+
+            data += self._decompressor.decompress(_EMPTY_BLOCK, max_length)
+
+            if self.remote_no_context_takeover:
+                self._decompressor = None
+
+        return data
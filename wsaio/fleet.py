@@ -0,0 +1,395 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from .client import WebSocketClient
+from .reconnect import WebSocketReconnector
+from .stats import aggregate_stats
+from .websocket import WebSocketOpcode
+
+FLEET_BATCH_SIZE = 256
+FLEET_BATCH_DELAY = 0.005
+FLEET_METRICS_INTERVAL = 1.0
+
+
+class FleetClient(WebSocketClient):
+    # The client class fleet workers run, received messages are forwarded
+    # to the parent process. Subclasses that override the message callbacks
+    # call forward() (or super()) for the messages the parent should get.
+    fleet_id = None
+    fleet_worker = None
+
+    def forward(self, opcode, data):
+        self.fleet_worker.forward(self.fleet_id, opcode, data)
+
+    def ws_text_received(self, data):
+        self.forward(WebSocketOpcode.TEXT, data)
+
+    def ws_binary_received(self, data):
+        self.forward(WebSocketOpcode.BINARY, bytes(data))
+
+
+class _PipeWriter:
+    # Sends over a multiprocessing connection from a thread of its own. Both
+    # processes write to their pipe while reading from it, a blocking send()
+    # on the event loop would deadlock once both ends fill up. A broken pipe
+    # means the other end is gone, the reader notices that by itself, so
+    # whatever is still queued is dropped.
+    def __init__(self, conn):
+        self.conn = conn
+        self.queue = queue.SimpleQueue()
+        self.broken = False
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def send(self, obj):
+        self.queue.put(obj)
+
+    def _run(self):
+        while True:
+            obj = self.queue.get()
+
+            if obj is None:
+                return
+
+            if self.broken:
+                continue
+
+            try:
+                self.conn.send(obj)
+            except OSError:
+                self.broken = True
+
+    def close(self):
+        # Waits until everything queued before is written (or dropped)
+        self.queue.put(None)
+        self.thread.join()
+
+
+class _FleetWorker:
+    # Runs in the worker process. Commands arrive from the parent as lists
+    # over the pipe, received messages are sent back in batches of up to
+    # batch_size or after batch_delay, whichever comes first.
+    def __init__(self, index, conn, client_class, batch_size, batch_delay, metrics_interval):
+        self.index = index
+        self.conn = conn
+        self.client_class = client_class
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.metrics_interval = metrics_interval
+
+        self.reconnectors = {}
+        self.outbox = []
+        self.messages_received = 0
+        self.bytes_received = 0
+        self.messages_sent = 0
+
+        self.loop = None
+        self.writer = None
+        self._flush_handle = None
+        self._stopped = None
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self._stopped = self.loop.create_future()
+        self.writer = _PipeWriter(self.conn)
+
+        self.loop.add_reader(self.conn.fileno(), self._read_commands)
+        metrics = self.loop.create_task(self._send_metrics())
+
+        try:
+            await self._stopped
+        finally:
+            self.loop.remove_reader(self.conn.fileno())
+            metrics.cancel()
+
+            for reconnector in self.reconnectors.values():
+                await reconnector.stop()
+
+            self.flush()
+            self.writer.close()
+
+    def _read_commands(self):
+        try:
+            while self.conn.poll():
+                for command in self.conn.recv():
+                    getattr(self, f'_command_{command[0]}')(*command[1:])
+        except (EOFError, OSError):
+            # The parent is gone
+            self._command_stop()
+
+    def _command_connect(self, fleet_id, url, args, kwargs):
+        client = self.client_class(self.loop)
+        client.fleet_id = fleet_id
+        client.fleet_worker = self
+
+        reconnector = WebSocketReconnector(client, url, *args, **kwargs)
+        self.reconnectors[fleet_id] = reconnector
+        reconnector.start()
+
+    def _command_disconnect(self, fleet_id):
+        reconnector = self.reconnectors.pop(fleet_id, None)
+
+        if reconnector is not None:
+            self.loop.create_task(reconnector.stop())
+
+    def _command_send(self, fleet_id, data, opcode):
+        reconnector = self.reconnectors.get(fleet_id)
+
+        if reconnector is None:
+            return
+
+        client = reconnector.client
+        protocol = client.protocol
+
+        if protocol is None or protocol.transport is None or protocol.transport.is_closing():
+            return
+
+        if isinstance(data, str):
+            data = data.encode()
+
+        protocol._write_frame(client._create_frame(data, WebSocketOpcode(opcode)))
+        self.messages_sent += 1
+
+    def _command_metrics(self):
+        self.writer.send([('metrics', self.index, self.get_metrics())])
+
+    def _command_stop(self):
+        if not self._stopped.done():
+            self._stopped.set_result(None)
+
+    def forward(self, fleet_id, opcode, data):
+        self.messages_received += 1
+        self.bytes_received += len(data)
+        self.outbox.append((fleet_id, int(opcode), data))
+
+        if len(self.outbox) >= self.batch_size:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = self.loop.call_later(self.batch_delay, self.flush)
+
+    def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if self.outbox:
+            outbox, self.outbox = self.outbox, []
+            self.writer.send([('messages', self.index, outbox)])
+
+    def get_metrics(self):
+        clients = [reconnector.client for reconnector in self.reconnectors.values()]
+
+        return {
+            'pid': os.getpid(),
+            'cpu_time': time.process_time(),
+            'connections': len(clients),
+            'connected': sum(
+                client.protocol is not None and client.protocol.transport is not None
+                and not client.protocol.transport.is_closing() for client in clients
+            ),
+            'reconnects': sum(
+                max(reconnector.connections - 1, 0) for reconnector in self.reconnectors.values()
+            ),
+            'messages_received': self.messages_received,
+            'bytes_received': self.bytes_received,
+            'messages_sent': self.messages_sent,
+            'stats': aggregate_stats(clients).as_dict(),
+        }
+
+    async def _send_metrics(self):
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            self._command_metrics()
+
+
+def _run_worker(*args):
+    worker = _FleetWorker(*args)
+    asyncio.run(worker.run())
+
+
+class _WorkerHandle:
+    # The parent's view of one worker process
+    def __init__(self, index, process, conn):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.writer = _PipeWriter(conn)
+        self.connections = set()
+        self.commands = []
+        self.metrics = None
+        self.alive = True
+
+
+class WebSocketFleet:
+    # Spreads client connections over worker processes, each running its
+    # own event loop with a WebSocketReconnector per connection. Messages
+    # received by the workers are forwarded in batches and returned by
+    # receive(). When a worker dies it is replaced and its connections are
+    # moved to the least loaded workers.
+    def __init__(
+        self, client_class=FleetClient, *, workers=None, loop=None,
+        batch_size=FLEET_BATCH_SIZE, batch_delay=FLEET_BATCH_DELAY,
+        metrics_interval=FLEET_METRICS_INTERVAL, mp_context=None
+    ):
+        if loop is not None:
+            self.loop = loop
+        else:
+            self.loop = asyncio.get_event_loop()
+
+        self.client_class = client_class
+        self.worker_count = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.metrics_interval = metrics_interval
+
+        # spawn by default, forking a process with a running loop is unsafe
+        self.mp_context = mp_context or multiprocessing.get_context('spawn')
+
+        self.workers = []
+        self.connections = {}
+
+        # fleet_id -> the _WorkerHandle running the connection
+        self.assignments = {}
+        self.restarts = 0
+
+        self._batches = asyncio.Queue()
+        self._flush_handle = None
+        self._closing = False
+
+    def _start_worker(self, index):
+        parent_conn, child_conn = self.mp_context.Pipe()
+
+        process = self.mp_context.Process(
+            target=_run_worker,
+            args=(
+                index, child_conn, self.client_class, self.batch_size, self.batch_delay,
+                self.metrics_interval
+            ),
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+
+        worker = _WorkerHandle(index, process, parent_conn)
+
+        self.loop.add_reader(parent_conn.fileno(), self._read_worker, worker)
+        self.loop.add_reader(process.sentinel, self._worker_died, worker)
+
+        return worker
+
+    def start(self):
+        for index in range(self.worker_count):
+            self.workers.append(self._start_worker(index))
+
+    def _send_command(self, worker, *command):
+        # Commands are gathered and sent as one list per worker
+        worker.commands.append(command)
+
+        if self._flush_handle is None:
+            self._flush_handle = self.loop.call_soon(self._flush_commands)
+
+    def _flush_commands(self):
+        self._flush_handle = None
+
+        for worker in self.workers:
+            if worker.commands and worker.alive:
+                commands, worker.commands = worker.commands, []
+                worker.writer.send(commands)
+
+    def _read_worker(self, worker):
+        try:
+            while worker.conn.poll():
+                for message in worker.conn.recv():
+                    if message[0] == 'messages':
+                        self._batches.put_nowait(message[2])
+                    elif message[0] == 'metrics':
+                        worker.metrics = message[2]
+        except (EOFError, OSError):
+            self._worker_died(worker)
+
+    def _worker_died(self, worker):
+        if not worker.alive:
+            return
+
+        worker.alive = False
+
+        self.loop.remove_reader(worker.conn.fileno())
+        self.loop.remove_reader(worker.process.sentinel)
+        worker.writer.close()
+        worker.conn.close()
+
+        if self._closing:
+            return
+
+        replacement = self._start_worker(worker.index)
+        self.workers[worker.index] = replacement
+        self.restarts += 1
+
+        for fleet_id in worker.connections:
+            self._assign(fleet_id)
+
+    def _assign(self, fleet_id):
+        url, args, kwargs = self.connections[fleet_id]
+        worker = min(
+            (worker for worker in self.workers if worker.alive),
+            key=lambda worker: len(worker.connections)
+        )
+
+        worker.connections.add(fleet_id)
+        self.assignments[fleet_id] = worker
+        self._send_command(worker, 'connect', fleet_id, url, args, kwargs)
+
+    def connect(self, fleet_id, url, *args, **kwargs):
+        # Opens a connection identified by fleet_id on the least loaded
+        # worker, args and kwargs are passed to WebSocketReconnector.
+        if fleet_id in self.connections:
+            raise ValueError(f'Connection {fleet_id!r} already exists')
+
+        self.connections[fleet_id] = (url, args, kwargs)
+        self._assign(fleet_id)
+
+    def disconnect(self, fleet_id):
+        del self.connections[fleet_id]
+
+        worker = self.assignments.pop(fleet_id)
+        worker.connections.discard(fleet_id)
+        self._send_command(worker, 'disconnect', fleet_id)
+
+    def send(self, fleet_id, data, *, opcode=WebSocketOpcode.TEXT):
+        # Raises KeyError for an unknown fleet_id, messages for a connection
+        # that is not connected at the moment are dropped by the worker.
+        self._send_command(self.assignments[fleet_id], 'send', fleet_id, data, int(opcode))
+
+    async def receive(self):
+        # Returns the next batch of (fleet_id, opcode, data) tuples
+        return await self._batches.get()
+
+    def get_metrics(self):
+        # The last metrics each worker reported, keyed by worker index
+        return {worker.index: worker.metrics for worker in self.workers}
+
+    async def close(self, timeout=5.0):
+        self._closing = True
+
+        waiters = []
+
+        for worker in self.workers:
+            if worker.alive:
+                self._send_command(worker, 'stop')
+                waiters.append(self.loop.run_in_executor(None, worker.process.join, timeout))
+
+        self._flush_commands()
+
+        if waiters:
+            await asyncio.gather(*waiters)
+
+        for worker in self.workers:
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+            self._worker_died(worker)
@@ -0,0 +1,163 @@
+import asyncio
+import struct
+import weakref
+
+from .exceptions import ConnectionClosedError
+from .protocol import WebSocketProtocolState
+from .websocket import WebSocketFrame, WebSocketOpcode
+
+HEARTBEAT_INTERVAL = 20.0
+HEARTBEAT_TICK = 1.0
+HEARTBEAT_MAX_MISSED = 2
+
+_schedulers = weakref.WeakKeyDictionary()
+
+
+class Heartbeat:
+    # The heartbeat state of one connection, rtt is the round-trip time of
+    # the last answered ping and srtt a smoothed average (as in TCP).
+    __slots__ = ('scheduler', 'protocol', 'slot', 'payload', 'sent_at', 'missed', 'rtt', 'srtt')
+
+    def __init__(self, scheduler, protocol, slot):
+        self.scheduler = scheduler
+        self.protocol = protocol
+        self.slot = slot
+
+        # The payload of the unanswered ping, if any
+        self.payload = None
+        self.sent_at = None
+        self.missed = 0
+
+        self.rtt = None
+        self.srtt = None
+
+    def pong_received(self, data):
+        if self.payload is None or data != self.payload:
+            return
+
+        self.rtt = self.scheduler.loop.time() - self.sent_at
+
+        if self.srtt is None:
+            self.srtt = self.rtt
+        else:
+            self.srtt += (self.rtt - self.srtt) / 8
+
+        self.payload = None
+        self.missed = 0
+
+
+class HeartbeatScheduler:
+    # Pings every registered connection once per interval from a hashed
+    # timer wheel with one slot per tick. Connections are spread over the
+    # slots and never move between them, so a tick only touches the slot
+    # that is due and one timer handle serves every connection. Peers that
+    # leave max_missed pings in a row unanswered are closed.
+    def __init__(
+        self, loop=None, *, interval=HEARTBEAT_INTERVAL, tick=HEARTBEAT_TICK,
+        max_missed=HEARTBEAT_MAX_MISSED
+    ):
+        if loop is not None:
+            self.loop = loop
+        else:
+            self.loop = asyncio.get_event_loop()
+
+        self.interval = interval
+        self.tick = tick
+        self.max_missed = max_missed
+
+        self.slots = [set() for _ in range(max(1, round(interval / tick)))]
+        self.cursor = 0
+        self.size = 0
+
+        self._counter = 0
+        self._deadline = None
+        self._handle = None
+
+    @classmethod
+    def get(cls, loop=None):
+        # Returns the scheduler shared by every connection on loop
+        if loop is None:
+            loop = asyncio.get_event_loop()
+
+        scheduler = _schedulers.get(loop)
+
+        if scheduler is None:
+            scheduler = _schedulers[loop] = cls(loop)
+
+        return scheduler
+
+    def add(self, protocol):
+        if protocol.heartbeat is not None:
+            return protocol.heartbeat
+
+        # The slot that was visited last, its next turn is one interval away
+        slot = self.slots[self.cursor - 1]
+
+        heartbeat = protocol.heartbeat = Heartbeat(self, protocol, slot)
+        slot.add(heartbeat)
+        self.size += 1
+
+        if self._handle is None:
+            self._deadline = self.loop.time() + self.tick
+            self._handle = self.loop.call_at(self._deadline, self._tick)
+
+        return heartbeat
+
+    def remove(self, protocol):
+        heartbeat = protocol.heartbeat
+
+        if heartbeat is None or heartbeat.scheduler is not self:
+            return
+
+        protocol.heartbeat = None
+        heartbeat.slot.discard(heartbeat)
+        self.size -= 1
+
+        if self.size == 0 and self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _tick(self):
+        slot = self.slots[self.cursor]
+        self.cursor = (self.cursor + 1) % len(self.slots)
+
+        now = self.loop.time()
+
+        for heartbeat in tuple(slot):
+            self._beat(heartbeat, now)
+
+        if self.size:
+            # Scheduled from the previous deadline so that ticks do not drift
+            self._deadline = max(self._deadline + self.tick, now)
+            self._handle = self.loop.call_at(self._deadline, self._tick)
+        else:
+            self._handle = None
+
+    def _beat(self, heartbeat, now):
+        protocol = heartbeat.protocol
+
+        if heartbeat.payload is not None:
+            heartbeat.missed += 1
+
+            if heartbeat.missed >= self.max_missed:
+                # A graceful close would wait for a peer that is gone
+                self.remove(protocol)
+                return protocol.abort(
+                    ConnectionClosedError(
+                        f'No pong received for the last {heartbeat.missed} pings',
+                        {'protocol': protocol}
+                    )
+                )
+
+        if (
+            protocol.state not in (WebSocketProtocolState.IDLE, WebSocketProtocolState.PARSING)
+            or protocol.transport.is_closing()
+        ):
+            return
+
+        self._counter += 1
+
+        heartbeat.payload = struct.pack('!Q', self._counter)
+        heartbeat.sent_at = now
+
+        protocol._write_frame(WebSocketFrame(opcode=WebSocketOpcode.PING, data=heartbeat.payload))
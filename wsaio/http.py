@@ -1,4 +1,3 @@
-import re
 from http import HTTPStatus
 
 from .exceptions import ParserInvalidDataError
@@ -6,6 +5,10 @@ from .utils import ensure_length
 
 _SENTINEL = object()
 
+# The limits for handshake headers, the size includes the start line
+MAX_HEADER_SIZE = 1 << 14
+MAX_HEADER_COUNT = 100
+
 
 class Headers(dict):
     def __setitem__(self, key, value):
@@ -20,13 +23,23 @@ class Headers(dict):
         super().__setitem__(key, values)
 
     def __getitem__(self, key):
-        return super().__getitem__(key.lower())
+        values = super().get(key)
+
+        if values is None:
+            return super().__getitem__(key.lower())
+
+        return values
 
     def __delitem__(self, key, value):
         return super().__delitem__(key.lower(), value)
 
-    def get(self, key, *args, **kwargs):
-        return super().get(key.lower(), *args, **kwargs)
+    def get(self, key, default=None):
+        values = super().get(key)
+
+        if values is None:
+            return super().get(key.lower(), default)
+
+        return values
 
     def pop(self, key, *args, **kwargs):
         return super().pop(key.lower(), *args, **kwargs)
@@ -46,36 +59,92 @@ class Headers(dict):
             return default
 
 
-def _iter_headers(headers):
+def _find_headers(extra, max_size, max_count):
+    # Reads up to the end of the headers, each chunk is only searched from
+    # where the previous search stopped. Returns the start line, the parsed
+    # headers and the data that followed them.
+    data = yield
     offset = 0
 
     while True:
-        index = headers.index(b'\r\n', offset) + 2
-        data = headers[offset:index]
-        offset = index
+        end = data.find(b'\r\n\r\n', offset)
 
-        if data == b'\r\n':
-            return
+        if end != -1:
+            break
 
-        yield [item.strip() for item in data.split(b':', 1)]
+        if len(data) > max_size:
+            raise ParserInvalidDataError(
+                f'The headers are larger than {max_size} bytes',
+                dict(extra, status=HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+            )
 
+        # The terminator may be split between two chunks
+        offset = max(len(data) - 3, 0)
 
-def _find_headers():
-    data = b''
+        if not isinstance(data, bytearray):
+            data = bytearray(data)
 
-    while True:
         data += yield
-        end = data.find(b'\r\n\r\n') + 4
 
-        if end != -1:
-            return _iter_headers(data[:end]), data[end:]
+    if end > max_size:
+        raise ParserInvalidDataError(
+            f'The headers are larger than {max_size} bytes',
+            dict(extra, status=HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+        )
 
+    start_line, *lines = bytes(data[:end]).split(b'\r\n')
 
-class HTTPResponse:
-    STATUS_LINE_REGEX = re.compile(
-        r'HTTP/(?P<version>\d((?=\.)(\.\d))?) (?P<status>\d+) (?P<phrase>.+)'
-    )
+    if len(lines) > max_count:
+        raise ParserInvalidDataError(
+            f'Received more than {max_count} headers',
+            dict(extra, status=HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+        )
+
+    headers = Headers()
+
+    for line in lines:
+        key, sep, value = line.partition(b':')
+
+        if not sep:
+            raise ParserInvalidDataError(f'Invalid header line: {line!r}', extra)
+
+        # Stored lowercased so that lookups by lowercase names skip lower()
+        dict.setdefault(headers, key.strip().lower(), []).append(value.strip())
+
+    return start_line, headers, bytes(data[end + 4:])
+
+
+def _parse_version(version, extra):
+    if not version.startswith(b'HTTP/'):
+        raise ParserInvalidDataError(f'Invalid HTTP version: {version!r}', extra)
+
+    return version[5:].decode('latin-1')
+
+
+def _read_body(headers, body, extra, max_size):
+    # Handshakes carry no real body, so it is limited like the headers
+    content_length = headers.getone(b'content-length')
+
+    if content_length is None:
+        return body, 0
 
+    if not content_length.isdigit():
+        raise ParserInvalidDataError(f'Invalid content-length: {content_length!r}', extra)
+
+    content_length = int(content_length)
+
+    if content_length > max_size:
+        raise ParserInvalidDataError(
+            f'The body is larger than {max_size} bytes',
+            dict(extra, status=HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        )
+
+    body = yield from ensure_length(body, content_length)
+
+    return body, content_length
+
+
+class HTTPResponse:
     def __init__(self, *, version='1.1', status, phrase, headers, body):
         self.version = version
         self.status = HTTPStatus(status)
@@ -92,38 +161,36 @@ class HTTPResponse:
         return b'\r\n'.join(part.encode() for part in response)
 
     @classmethod
-    def parser(cls, protocol):
-        headers, body = yield from _find_headers()
-
-        status_line, = next(headers)
-
+    def parser(cls, protocol, *, max_size=MAX_HEADER_SIZE, max_count=MAX_HEADER_COUNT):
         extra = {
-            'protocol': protocol,
-            'status_line': status_line
+            'protocol': protocol
         }
 
-        match = cls.STATUS_LINE_REGEX.match(status_line.decode())
-
-        if match is None:
-            raise ParserInvalidDataError('The status line is invalid', extra)
+        status_line, headers, body = yield from _find_headers(extra, max_size, max_count)
 
-        headers_dict = Headers()
+        extra['status_line'] = status_line
 
-        for key, value in headers:
-            headers_dict[key] = value
+        version, _, status_line_rest = status_line.partition(b' ')
+        status, _, phrase = status_line_rest.partition(b' ')
 
-        content_length = headers_dict.getone(b'content-length')
+        version = _parse_version(version, extra)
 
-        if content_length is not None:
-            content_length = int(content_length.decode())
-        else:
+        try:
+            if len(status) != 3 or not status.isdigit():
+                raise ValueError
+            status = HTTPStatus(int(status))
+        except ValueError:
+            raise ParserInvalidDataError('The status line is invalid', extra) from None
+
+        if status is HTTPStatus.SWITCHING_PROTOCOLS:
+            # 1xx responses have no body, the new protocol starts right away
             content_length = 0
-
-        body = yield from ensure_length(body, content_length)
+        else:
+            body, content_length = yield from _read_body(headers, body, extra, max_size)
 
         response = cls(
-            version=match.group('version'), status=int(match.group('status')),
-            phrase=match.group('phrase'), headers=headers_dict, body=body[:content_length]
+            version=version, status=status, phrase=phrase.decode('latin-1'), headers=headers,
+            body=body[:content_length]
         )
 
         protocol.http_response_received(response)
@@ -134,10 +201,6 @@ class HTTPResponse:
 class HTTPRequest:
     METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'DELETE', 'CONNECT', 'OPTIONS', 'TRACE', 'PATCH')
 
-    REQUEST_LINE_REXEX = re.compile(
-        rf'(?P<method>{"|".join(METHODS)}) (?P<path>.+) HTTP/(?P<version>\d((?=\.)(\.\d))?)'
-    )
-
     def __init__(self, *, version='1.1', method, path=None, headers, body):
         self.version = version
         self.method = method
@@ -154,38 +217,33 @@ class HTTPRequest:
         return b'\r\n'.join(part.encode() for part in request)
 
     @classmethod
-    def parser(cls, protocol):
-        headers, body = yield from _find_headers()
-
-        request_line, = next(headers)
-
+    def parser(cls, protocol, *, max_size=MAX_HEADER_SIZE, max_count=MAX_HEADER_COUNT):
         extra = {
-            'protocol': protocol,
-            'request_line': request_line
+            'protocol': protocol
         }
 
-        match = cls.REQUEST_LINE_REXEX.match(request_line.decode())
+        request_line, headers, body = yield from _find_headers(extra, max_size, max_count)
 
-        if match is None:
-            raise ParserInvalidDataError('The request line is invalid', extra)
+        extra['request_line'] = request_line
 
-        headers_dict = Headers()
+        parts = request_line.decode('latin-1').split(' ')
 
-        for key, value in headers:
-            headers_dict[key] = value
+        if len(parts) != 3 or parts[0] not in cls.METHODS or not parts[1]:
+            raise ParserInvalidDataError('The request line is invalid', extra)
 
-        content_length = headers_dict.getone(b'content-length')
+        method, path, version = parts
+        version = _parse_version(version.encode('latin-1'), extra)
 
-        if content_length is not None:
-            content_length = int(content_length.decode())
-        else:
-            content_length = 0
+        content_length = headers.getone(b'content-length', b'0')
+
+        if headers.getone(b'upgrade') is not None and content_length != b'0':
+            raise ParserInvalidDataError('Received an upgrade request with a body', extra)
 
-        body = yield from ensure_length(body, content_length)
+        body, content_length = yield from _read_body(headers, body, extra, max_size)
 
         request = cls(
-            version=match.group('version'), method=match.group('method'), path=match.group('path'),
-            headers=headers_dict, body=body
+            version=version, method=method, path=path, headers=headers,
+            body=body[:content_length]
         )
 
         protocol.http_request_received(request)
@@ -0,0 +1,67 @@
+import os
+
+# Payloads shorter than this are masked with a single integer XOR, longer
+# ones are masked with one bytes.translate() per mask byte, which is faster
+# once the per-call overhead stops dominating.
+MASK_TRANSLATE_THRESHOLD = 2048
+
+# Long payloads are masked in blocks so that the temporary lane copies stay
+# small. The block size has to be a multiple of 4 so that every block starts
+# at the beginning of the mask.
+MASK_BLOCK_SIZE = 1 << 20
+
+_from_bytes = int.from_bytes
+
+_IDENTITY = _from_bytes(bytes(range(256)), 'little')
+
+# _MASK_TABLES[k] maps every byte b to b ^ k.
+_MASK_TABLES = tuple(
+    (_IDENTITY ^ _from_bytes(bytes((key,)) * 256, 'little')).to_bytes(256, 'little')
+    for key in range(256)
+)
+
+
+def generate_mask():
+    return os.urandom(4)
+
+
+def _repeat_mask(mask, length):
+    return (bytes(mask) * ((length >> 2) + 1))[:length]
+
+
+# The result is written to out[offset:offset + len(data)] when out is given,
+# out may be the buffer that data is a view of (data must then be the view
+# out[offset:offset + len(data)], this unmasks in place) or a bytearray that
+# the result should be appended to.
+def apply_mask(data, mask, out=None, offset=0):
+    length = len(data)
+
+    if out is None:
+        out = bytearray()
+        offset = 0
+
+    if length < MASK_TRANSLATE_THRESHOLD:
+        if length:
+            key = _repeat_mask(mask, length)
+            value = _from_bytes(data, 'little') ^ _from_bytes(key, 'little')
+            out[offset:offset + length] = value.to_bytes(length, 'little')
+
+        return out
+
+    end = offset + length
+
+    if not (isinstance(data, memoryview) and data.obj is out):
+        out[offset:end] = data
+
+    tables = [_MASK_TABLES[key] for key in mask]
+
+    for start in range(offset, end, MASK_BLOCK_SIZE):
+        stop = min(start + MASK_BLOCK_SIZE, end)
+
+        for lane, table in enumerate(tables, start):
+            # An empty extended slice assignment would be treated as a resize,
+            # which fails while views of the buffer are exported.
+            if lane < stop:
+                out[lane:stop:4] = out[lane:stop:4].translate(table)
+
+    return out
@@ -0,0 +1,266 @@
+BUFFER_POOL_MIN_SIZE = 1 << 12
+BUFFER_POOL_MAX_SIZE = 1 << 24
+
+# The most bytes kept on the free lists, released buffers beyond this are dropped
+BUFFER_POOL_MAX_FREE = 1 << 26
+
+
+class BufferPool:
+    # Hands out bytearrays rounded up to a power of two size class and keeps
+    # released ones on a free list per class for the next acquire(), up to
+    # max_free bytes in total. Sizes above max_size are allocated as usual.
+    #
+    # Buffers acquired for an owner (a protocol), and bytes charged to it
+    # directly, count as its buffered inbound data. When the total exceeds
+    # budget, reading is paused on the largest owners until the paused ones
+    # hold at least the excess, but never the last one that is reading.
+    # Paused owners are resumed, smallest first, while the others hold no
+    # more than low. Owners are kept in buckets by the bit length of their
+    # usage, so that finding the largest or smallest ones does not sort them
+    # on every charge (within a bucket the order is arbitrary).
+    def __init__(
+        self, *, min_size=BUFFER_POOL_MIN_SIZE, max_size=BUFFER_POOL_MAX_SIZE,
+        max_free=BUFFER_POOL_MAX_FREE, budget=None, low=None
+    ):
+        self.min_bits = (min_size - 1).bit_length()
+        self.max_bits = (max_size - 1).bit_length()
+        self.max_free = max_free
+
+        self.free = {bits: [] for bits in range(self.min_bits, self.max_bits + 1)}
+
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+
+        # Bytes acquired and not released yet, and bytes on the free lists
+        self.bytes_in_use = 0
+        self.bytes_free = 0
+
+        self.usage = {}
+        self.paused = set()
+        self.inbound_bytes = 0
+        self.pause_count = 0
+
+        # bit length -> owners, for the owners that are reading and hold
+        # anything and for every paused owner. paused_bytes is what the
+        # paused owners hold.
+        self.active_buckets = {}
+        self.paused_buckets = {}
+        self.active_count = 0
+        self.paused_bytes = 0
+
+        self.set_budget(budget, low)
+
+    def set_budget(self, budget, low=None):
+        # budget=None disables the limit and resumes every paused owner
+        if budget is not None and low is None:
+            low = budget * 3 // 4
+
+        if budget is not None and not budget >= low >= 0:
+            raise ValueError('budget must be >= low must be >= 0')
+
+        self.budget = budget
+        self.low = low
+
+        if budget is None:
+            for owner in tuple(self.paused):
+                self._resume(owner)
+        elif self.inbound_bytes > budget:
+            self._pause_largest()
+
+    def acquire(self, size, owner=None):
+        bits = max((size - 1).bit_length(), self.min_bits)
+
+        if bits > self.max_bits:
+            buffer = bytearray(size)
+            self.misses += 1
+        else:
+            free = self.free[bits]
+
+            if free:
+                buffer = free.pop()
+                self.bytes_free -= len(buffer)
+                self.hits += 1
+            else:
+                buffer = bytearray(1 << bits)
+                self.misses += 1
+
+        self.bytes_in_use += len(buffer)
+
+        if owner is not None:
+            self.charge(owner, len(buffer))
+
+        return buffer
+
+    def release(self, buffer, owner=None):
+        # The buffer must not be used (or have views in use) afterwards
+        size = len(buffer)
+        self.bytes_in_use -= size
+
+        if owner is not None:
+            self.charge(owner, -size)
+
+        bits = size.bit_length() - 1
+
+        if (
+            size == 1 << bits and self.min_bits <= bits <= self.max_bits
+            and self.bytes_free + size <= self.max_free
+        ):
+            self.free[bits].append(buffer)
+            self.bytes_free += size
+        else:
+            self.discarded += 1
+
+    def charge(self, owner, size):
+        # Adds size (which may be negative) to the inbound bytes held by owner
+        previous = self.usage.get(owner, 0)
+        usage = previous + size
+
+        if usage:
+            self.usage[owner] = usage
+        else:
+            self.usage.pop(owner, None)
+
+        self.inbound_bytes += size
+
+        if owner in self.paused:
+            self.paused_bytes += size
+
+            if previous.bit_length() != usage.bit_length():
+                _bucket_remove(self.paused_buckets, owner, previous)
+                _bucket_add(self.paused_buckets, owner, usage)
+
+        elif previous.bit_length() != usage.bit_length():
+            if previous:
+                _bucket_remove(self.active_buckets, owner, previous)
+            else:
+                self.active_count += 1
+
+            if usage:
+                _bucket_add(self.active_buckets, owner, usage)
+            else:
+                self.active_count -= 1
+
+        if self.budget is None:
+            return
+
+        if size > 0:
+            if self.inbound_bytes > self.budget:
+                self._pause_largest()
+        elif self.paused:
+            self._resume_smallest()
+
+    def forget(self, owner):
+        # Called once owner is gone, whatever it still held is written off
+        size = self.usage.pop(owner, 0)
+        self.inbound_bytes -= size
+
+        if owner in self.paused:
+            self.paused.discard(owner)
+            self.paused_bytes -= size
+            _bucket_remove(self.paused_buckets, owner, size)
+        elif size:
+            self.active_count -= 1
+            _bucket_remove(self.active_buckets, owner, size)
+
+        if self.paused and self.budget is not None:
+            self._resume_smallest()
+
+    def _pause_largest(self):
+        excess = self.inbound_bytes - self.budget - self.paused_bytes
+
+        if excess <= 0:
+            return
+
+        usage = self.usage
+        buckets = self.active_buckets
+
+        # Owners usually hold memory for a frame they have only partly
+        # received, one of them keeps reading so that some frame completes
+        # and its memory is released.
+        while excess > 0 and self.active_count > 1:
+            owner = next(iter(buckets[max(buckets)]))
+            excess -= usage[owner]
+            self._pause(owner)
+
+    def _resume_smallest(self):
+        usage = self.usage
+        buckets = self.paused_buckets
+        active = self.inbound_bytes - self.paused_bytes
+
+        while buckets:
+            owner = next(iter(buckets[min(buckets)]))
+            size = usage.get(owner, 0)
+
+            # One owner is always resumed once nobody else holds anything,
+            # otherwise owners holding more than low would never be resumed.
+            if active and active + size > self.low:
+                return
+
+            self._resume(owner)
+            active += size
+
+    def _pause(self, owner):
+        size = self.usage[owner]
+
+        _bucket_remove(self.active_buckets, owner, size)
+        _bucket_add(self.paused_buckets, owner, size)
+        self.active_count -= 1
+        self.paused_bytes += size
+
+        self.paused.add(owner)
+        self.pause_count += 1
+        owner._set_budget_paused(True)
+
+    def _resume(self, owner):
+        size = self.usage.get(owner, 0)
+
+        _bucket_remove(self.paused_buckets, owner, size)
+        self.paused_bytes -= size
+
+        if size:
+            _bucket_add(self.active_buckets, owner, size)
+            self.active_count += 1
+
+        self.paused.discard(owner)
+        owner._set_budget_paused(False)
+
+    def get_stats(self):
+        requests = self.hits + self.misses
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'discarded': self.discarded,
+            'bytes_in_use': self.bytes_in_use,
+            'bytes_free': self.bytes_free,
+            'inbound_bytes': self.inbound_bytes,
+            'inbound_budget': self.budget,
+            'paused': len(self.paused),
+            'pause_count': self.pause_count,
+        }
+
+
+def _bucket_add(buckets, owner, size):
+    bits = size.bit_length()
+    bucket = buckets.get(bits)
+
+    if bucket is None:
+        bucket = buckets[bits] = set()
+
+    bucket.add(owner)
+
+
+def _bucket_remove(buckets, owner, size):
+    bits = size.bit_length()
+    bucket = buckets[bits]
+    bucket.discard(owner)
+
+    if not bucket:
+        del buckets[bits]
+
+
+# The pool shared by every connection unless another one is given, without
+# a budget by default (see BufferPool.set_budget())
+BUFFER_POOL = BufferPool()
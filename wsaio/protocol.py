@@ -1,7 +1,13 @@
 import asyncio
+import collections
+import contextlib
 import enum
+import inspect
+import time
 
 from .exceptions import ConnectionClosedError
+from .stats import ConnectionStats, live_stats
+from .websocket import FRAGMENT_SIZE, WebSocketCloseCode, WebSocketFrame, WebSocketOpcode
 
 
 class WebSocketProtocolState(enum.IntEnum):
@@ -10,9 +16,77 @@ class WebSocketProtocolState(enum.IntEnum):
     PARSING = 2
     CLOSED = 3
     HANDSHAKING = 4
+    # A CLOSE frame was sent or received, waiting for the other end
+    CLOSING = 5
+
+
+CALLBACKS = (
+    'connection_made',
+    'connection_lost',
+    'connection_closing',
+    'parser_failed',
+    'http_response_received',
+    'http_request_received',
+    'ws_connected',
+)
+
+# Coroutine implementations of these are awaited one after another by the
+# connection's dispatcher, so that they run in the order the data arrived
+# without creating a task per message. The others get a task each because
+# they may run for the lifetime of the connection (e.g. ws_connected).
+MESSAGE_CALLBACKS = (
+    'data_received',
+    'ws_frame_received',
+    'ws_binary_received',
+    'ws_text_received',
+    'ws_fragment_received',
+    'ws_object_received',
+    'ws_ping_received',
+    'ws_pong_received',
+    'ws_close_received',
+)
+
+# Default receive limits, reading is paused once the queued coroutine
+# handlers hold more than the high limit and resumed at the low limit.
+RECEIVE_HIGH_WATER = 1 << 20
+RECEIVE_HIGH_WATER_MESSAGES = 256
+
+# Seconds to wait for the close handshake before the transport is aborted
+CLOSE_TIMEOUT = 10.0
+
+_CALLBACK_SYNC = 0
+_CALLBACK_TASK = 1
+_CALLBACK_ORDERED = 2
+
+
+def _copy_view(arg):
+    # A copy of a memoryview argument, or of a frame with a memoryview payload
+    if isinstance(arg, memoryview):
+        return bytes(arg)
+
+    if isinstance(arg, WebSocketFrame) and isinstance(arg.data, memoryview):
+        return WebSocketFrame(
+            opcode=arg.opcode, fin=arg.fin, rsv1=arg.rsv1, rsv2=arg.rsv2, rsv3=arg.rsv3,
+            data=bytes(arg.data)
+        )
+
+    return arg
 
 
 class WebSocketProtocol(asyncio.Protocol):
+    # Servers keep one of these per connection
+    __slots__ = (
+        'client', 'loop', '_paused', '_drain_waiter', '_parser', '_feed_parser',
+        'transport', 'state', 'extensions', '_callbacks', '_dispatch_queue', '_dispatch_task',
+        '_pending_bytes', '_parser_pending_bytes', '_parser_pending_messages', '_reading_paused',
+        '_receive_high', '_receive_low', '_receive_high_messages', '_receive_low_messages',
+        'reading_paused_count', 'reading_resumed_count', '_cork_delay', '_cork_buffers',
+        '_cork_size', '_cork_handle', '_batch_depth', '_closed', 'heartbeat', 'stats',
+        '_budget_paused',
+        '_close_sent', '_close_received', '_close_handle', '_send_queue', '_send_offset',
+        '_send_fragmented', '_held_frames', '_held_waiter'
+    )
+
     def __init__(self, client):
         self.client = client
         self.client.protocol = self
@@ -21,19 +95,240 @@ class WebSocketProtocol(asyncio.Protocol):
         self._paused = False
         self._drain_waiter = None
 
+        # Data frames waiting for the transport, see _flush_send_queue().
+        # _send_offset is how much of the first one was written already.
+        self._send_queue = None
+        self._send_offset = 0
+
+        # Set while a fragmented message is being sent, other data frames
+        # are held back until its last fragment is written.
+        self._send_fragmented = False
+        self._held_frames = None
+        self._held_waiter = None
+        self._closed = self.loop.create_future()
+
+        self._close_sent = False
+        self._close_received = False
+        self._close_handle = None
+
+        # Set by HeartbeatScheduler.add()
+        self.heartbeat = None
+
+        # A ConnectionStats once enable_stats() is called, every counter is
+        # behind a check of this attribute.
+        self.stats = None
+
         self._parser = None
+        self._feed_parser = None
 
         self.transport = None
         self.state = WebSocketProtocolState.INIT
 
         self.extensions = []
 
-    def _run_callback(self, name, *args, **kwargs):
-        func = getattr(self.client, name)
-        coro = func(*args, **kwargs)
+        self._callbacks = {}
+        self._dispatch_queue = None
+        self._dispatch_task = None
+
+        self._pending_bytes = 0
+        self._reading_paused = False
+
+        # Messages the parser holds back behind an offloaded one, they count
+        # towards the receive limits like the queued handlers.
+        self._parser_pending_bytes = 0
+        self._parser_pending_messages = 0
+        self.reading_paused_count = 0
+        self.reading_resumed_count = 0
+
+        # Set by the BufferPool while its inbound budget is exceeded, reading
+        # stays paused as long as either this or _reading_paused is set.
+        self._budget_paused = False
+
+        self.set_receive_limits()
+
+        self._cork_delay = None
+        self._cork_buffers = None
+        self._cork_size = 0
+        self._cork_handle = None
+        self._batch_depth = 0
+
+        for name in CALLBACKS:
+            self._callbacks[name] = self._resolve_callback(name, _CALLBACK_TASK)
+
+        for name in MESSAGE_CALLBACKS:
+            self._callbacks[name] = self._resolve_callback(name, _CALLBACK_ORDERED)
+
+    def _resolve_callback(self, name, coroutine_kind):
+        func = getattr(self.client, name, None)
+
+        if func is None or getattr(func, '_noop_callback', False):
+            return None
 
         if asyncio.iscoroutinefunction(func):
-            self.loop.create_task(coro)
+            return func, coroutine_kind
+
+        return func, _CALLBACK_SYNC
+
+    def has_callback(self, name):
+        return self._callbacks.get(name) is not None
+
+    def _run_callback(self, name, *args):
+        callback = self._callbacks[name]
+
+        if callback is None:
+            return
+
+        func, kind = callback
+
+        if kind is _CALLBACK_SYNC:
+            func(*args)
+        elif kind is _CALLBACK_ORDERED:
+            self._dispatch(func, args)
+        else:
+            task = self.loop.create_task(func(*args))
+
+            if self.stats is not None:
+                self.stats.callback_tasks += 1
+                task.add_done_callback(self.stats.callback_task_done)
+
+    def enable_stats(self):
+        if self.stats is None:
+            self.stats = ConnectionStats(self)
+            live_stats.add(self.stats)
+
+        return self.stats
+
+    def set_receive_limits(self, high=None, low=None, *, high_messages=None, low_messages=None):
+        # Mirrors transport.set_write_buffer_limits(), the limits apply to the
+        # messages waiting for coroutine handlers in bytes and in messages.
+        if high is None:
+            high = RECEIVE_HIGH_WATER if low is None else low * 4
+
+        if low is None:
+            low = high // 4
+
+        if high_messages is None:
+            if low_messages is None:
+                high_messages = RECEIVE_HIGH_WATER_MESSAGES
+            else:
+                high_messages = low_messages * 4
+
+        if low_messages is None:
+            low_messages = high_messages // 4
+
+        if not high >= low >= 0 or not high_messages >= low_messages >= 0:
+            raise ValueError('high must be >= low must be >= 0')
+
+        self._receive_high = high
+        self._receive_low = low
+        self._receive_high_messages = high_messages
+        self._receive_low_messages = low_messages
+
+    def get_pending_size(self):
+        if self._dispatch_queue is None:
+            return 0, 0
+
+        return self._pending_bytes, len(self._dispatch_queue)
+
+    def _dispatch(self, func, args):
+        if self._dispatch_queue is None:
+            self._dispatch_queue = collections.deque()
+
+        size = 0
+
+        # Views of the receive buffer (zero_copy) are only valid until the
+        # parser moves on, queued handlers need a copy. That includes the
+        # payload of a frame passed to ws_frame_received.
+        if any(
+            isinstance(arg, memoryview)
+            or isinstance(arg, WebSocketFrame) and isinstance(arg.data, memoryview)
+            for arg in args
+        ):
+            args = tuple(_copy_view(arg) for arg in args)
+
+        for arg in args:
+            if isinstance(arg, WebSocketFrame):
+                arg = arg.data
+
+            if isinstance(arg, (bytes, bytearray, str)):
+                size += len(arg)
+
+        self._dispatch_queue.append((func, args, size))
+        self._pending_bytes += size
+        self._check_receive_limits()
+
+        if self._dispatch_task is None:
+            self._dispatch_task = self.loop.create_task(self._run_dispatch_queue())
+
+    def _add_parser_pending(self, size, count):
+        self._parser_pending_bytes += size
+        self._parser_pending_messages += count
+        self._check_receive_limits()
+
+    def _check_receive_limits(self):
+        size = self._pending_bytes + self._parser_pending_bytes
+        count = self._parser_pending_messages
+
+        if self._dispatch_queue is not None:
+            count += len(self._dispatch_queue)
+
+        if self._reading_paused:
+            if size <= self._receive_low and count <= self._receive_low_messages:
+                self._resume_reading()
+        elif size > self._receive_high or count > self._receive_high_messages:
+            self._pause_reading()
+
+    def _pause_reading(self):
+        if self.transport is None or self.transport.is_closing():
+            return
+
+        self._reading_paused = True
+
+        if not self._budget_paused:
+            self.reading_paused_count += 1
+            self.transport.pause_reading()
+
+    def _resume_reading(self):
+        self._reading_paused = False
+
+        if not self._budget_paused:
+            self.reading_resumed_count += 1
+
+            if not self.transport.is_closing():
+                self.transport.resume_reading()
+
+    def _set_budget_paused(self, paused):
+        self._budget_paused = paused
+
+        if self._reading_paused or self.transport is None or self.transport.is_closing():
+            return
+
+        if paused:
+            self.reading_paused_count += 1
+            self.transport.pause_reading()
+        else:
+            self.reading_resumed_count += 1
+            self.transport.resume_reading()
+
+    async def _run_dispatch_queue(self):
+        queue = self._dispatch_queue
+
+        try:
+            while queue:
+                func, args, size = queue.popleft()
+                self._pending_bytes -= size
+                self._check_receive_limits()
+
+                try:
+                    await func(*args)
+                except Exception as exc:
+                    self.loop.call_exception_handler({
+                        'message': f'Exception in callback {func.__qualname__}',
+                        'exception': exc,
+                        'protocol': self
+                    })
+        finally:
+            self._dispatch_task = None
 
     def _set_paused(self, paused):
         assert self._paused is (not paused)
@@ -44,17 +339,33 @@ class WebSocketProtocol(asyncio.Protocol):
         self._run_callback('connection_made', transport)
 
     def set_parser(self, parser):
-        parser.send(None)
+        # Generator based parsers return the data they did not consume once
+        # they are done, parser objects (WebSocketFrameParser) never finish.
+        if inspect.isgenerator(parser):
+            parser.send(None)
+            self._feed_parser = parser.send
+        else:
+            self._feed_parser = parser.feed
+
         self._parser = parser
 
+    def _restore_state(self, state):
+        # The handshake callbacks change the state while parsing
+        if self.state is WebSocketProtocolState.PARSING:
+            self.state = state
+
     def data_received(self, data):
         state = self.state
+        stats = self.stats
+
+        if stats is not None:
+            started = time.perf_counter()
 
         self.state = WebSocketProtocolState.PARSING
 
         while data:
             try:
-                self._parser.send(data)
+                self._feed_parser(data)
                 break
             except StopIteration as err:
                 data = err.value
@@ -62,16 +373,31 @@ class WebSocketProtocol(asyncio.Protocol):
                 self._run_callback('parser_failed', err)
                 break
 
-        self.state = state
+        self._restore_state(state)
+
+        if stats is not None:
+            stats.parser_ran(time.perf_counter() - started)
 
         self._run_callback('data_received', data)
 
     def pause_writing(self):
         self._set_paused(True)
 
+        if self.stats is not None:
+            self.stats.pause_writing_count += 1
+
     def resume_writing(self):
         self._set_paused(False)
 
+        if self.stats is not None:
+            self.stats.resume_writing_count += 1
+
+        self._flush_send_queue()
+
+        # Writers wait until the queued frames are written as well
+        if self._paused or self._send_queue:
+            return
+
         waiter = self._drain_waiter
 
         if waiter is not None:
@@ -81,8 +407,42 @@ class WebSocketProtocol(asyncio.Protocol):
                 waiter.set_result(None)
 
     def connection_lost(self, exc):
+        if self.state is WebSocketProtocolState.HANDSHAKING:
+            self.client.handshake_failed(
+                ConnectionClosedError('Connection lost during handshake', {'protocol': self})
+            )
+
         self.state = WebSocketProtocolState.CLOSED
 
+        if self.heartbeat is not None:
+            self.heartbeat.scheduler.remove(self)
+
+        if self.stats is not None:
+            live_stats.discard(self.stats)
+
+        if self._parser is not None and not inspect.isgenerator(self._parser):
+            self._parser.release()
+
+        if not self._closed.done():
+            self._closed.set_result(None)
+
+        if self._cork_handle is not None:
+            self._cork_handle.cancel()
+            self._cork_handle = None
+
+        if self._close_handle is not None:
+            self._close_handle.cancel()
+            self._close_handle = None
+
+        self._cork_buffers = None
+        self._cork_size = 0
+        self._discard_send_queue()
+        self._held_frames = None
+        self._release_held_waiter()
+        self._wake_drain_waiter(exc)
+        self._run_callback('connection_lost', exc)
+
+    def _wake_drain_waiter(self, exc):
         if not self._paused:
             return
 
@@ -101,14 +461,15 @@ class WebSocketProtocol(asyncio.Protocol):
         else:
             waiter.set_result(None)
 
-        self._run_callback('connection_lost', exc)
-
     def connection_closing(self, exc):
         self._run_callback('connection_closing', exc)
 
     def http_response_received(self, response):
         self._run_callback('http_response_received', response)
 
+    def http_request_received(self, request):
+        self._run_callback('http_request_received', request)
+
     def ws_connected(self):
         self._run_callback('ws_connected')
 
@@ -121,29 +482,105 @@ class WebSocketProtocol(asyncio.Protocol):
     def ws_text_received(self, data):
         self._run_callback('ws_text_received', data)
 
+    def ws_fragment_received(self, opcode, data, fin):
+        self._run_callback('ws_fragment_received', opcode, data, fin)
+
+    def ws_object_received(self, obj):
+        self._run_callback('ws_object_received', obj)
+
     def ws_ping_received(self, data):
+        if self._callbacks['ws_ping_received'] is None:
+            # Pings are answered here unless the client handles them itself,
+            # the payload is copied because it may point into the receive buffer.
+            if self.state is not WebSocketProtocolState.CLOSED and not self.transport.is_closing():
+                self._write_frame(WebSocketFrame(opcode=WebSocketOpcode.PONG, data=bytes(data)))
+
         self._run_callback('ws_ping_received', data)
 
     def ws_pong_received(self, data):
+        if self.heartbeat is not None:
+            self.heartbeat.pong_received(data)
+
         self._run_callback('ws_pong_received', data)
 
     def ws_close_received(self, code, data):
+        self._close_received = True
         self._run_callback('ws_close_received', code, data)
 
+        # Answered with the same code unless the callback already did
+        self.start_close(code or None)
+
+    def start_close(self, code=WebSocketCloseCode.NORMAL_CLOSURE, reason=b'', *, timeout=None):
+        # Sends a CLOSE frame unless one was sent already. Once both ends
+        # have sent one the server closes the transport, the client waits
+        # for the server to do that (RFC 6455 7.1.1). If the handshake takes
+        # longer than timeout (the client's close_timeout by default) the
+        # transport is aborted. code=None sends a CLOSE without a code. The
+        # deadline is set whatever the state, a closed transport may still
+        # be flushing to a peer that never reads.
+        if self.transport is None or self._closed.done():
+            return
+
+        if self.state in (WebSocketProtocolState.INIT, WebSocketProtocolState.HANDSHAKING):
+            self.close()
+
+        elif self.state is not WebSocketProtocolState.CLOSED:
+            if not self._close_sent:
+                data = b''
+
+                if code is not None:
+                    data = code.to_bytes(2, 'big', signed=False) + reason
+
+                # Queued data frames are written first, nothing is sent after it
+                self._write_frame(WebSocketFrame(opcode=WebSocketOpcode.CLOSE, data=data))
+                self._close_sent = True
+
+            if self._close_received and not self.client.masked:
+                self.close()
+            else:
+                self.state = WebSocketProtocolState.CLOSING
+
+        if self._close_handle is None:
+            if timeout is None:
+                timeout = self.client.close_timeout
+
+            self._close_handle = self.loop.call_later(timeout, self.abort)
+
+    async def wait_closed(self):
+        # Waits until the transport is gone (connection_lost)
+        await asyncio.shield(self._closed)
+
     async def drain(self):
         if self.state is WebSocketProtocolState.CLOSED:
             raise ConnectionClosedError(
                 'Attempt to drain a closed transport', {'protocol': self}
             )
 
+        # Corked writes are handed to the transport first, it only pauses
+        # once it holds them. The send queue is only left non-empty while
+        # the transport is paused, resume_writing() wakes the waiter once the
+        # queue is written too.
+        if self._cork_buffers:
+            self.flush()
+
         if not self._paused:
             return
 
-        assert self._drain_waiter is None or self._drain_waiter.cancelled()
+        waiter = self._drain_waiter
+
+        if waiter is None or waiter.done():
+            waiter = self._drain_waiter = self.loop.create_future()
+
+        if self.stats is None:
+            return await waiter
 
-        waiter = self._drain_waiter = self.loop.create_future()
+        started = time.perf_counter()
 
-        return waiter
+        try:
+            await waiter
+        finally:
+            self.stats.drain_count += 1
+            self.stats.drain_time += time.perf_counter() - started
 
     async def write(self, data, *, wait=False):
         if self.state is WebSocketProtocolState.CLOSED:
@@ -151,14 +588,296 @@ class WebSocketProtocol(asyncio.Protocol):
                 'Attempt to write to a closed transport', {'procotol': self}
             )
 
-        self.transport.write(data)
+        self._write((data,))
 
         if wait:
             await self.drain()
 
+    async def writelines(self, data, *, wait=False):
+        if self.state is WebSocketProtocolState.CLOSED:
+            raise ConnectionClosedError(
+                'Attempt to write to a closed transport', {'procotol': self}
+            )
+
+        self._write(data)
+
+        if wait:
+            await self.drain()
+
+    async def write_close(self, code, reason=b'', *, wait=False, timeout=None):
+        if self.state is WebSocketProtocolState.CLOSED:
+            raise ConnectionClosedError(
+                'Attempt to write to a closed transport', {'procotol': self}
+            )
+
+        self.start_close(code, reason, timeout=timeout)
+
+        if wait and self.state is not WebSocketProtocolState.CLOSED:
+            await self.drain()
+
+    async def write_frame(self, frame, *, wait=False):
+        if self.state is WebSocketProtocolState.CLOSED:
+            raise ConnectionClosedError(
+                'Attempt to write to a closed transport', {'procotol': self}
+            )
+
+        self._write_frame(frame)
+
+        if not wait:
+            return
+
+        held = self._held_frames
+
+        if held and held[-1] is frame:
+            # Not written before the fragmented message being sent is complete
+            if self._held_waiter is None:
+                self._held_waiter = self.loop.create_future()
+
+            await self._held_waiter
+
+        await self.drain()
+
+    def _write_frame(self, frame):
+        # Control frames are written right away. Data frames go through the
+        # send queue while it is not empty, while the transport is paused
+        # and when they are larger than FRAGMENT_SIZE. Once the first frame
+        # of a fragmented message is written, other data frames are held
+        # until a final CONTINUATION frame ends the message. A CLOSE frame
+        # waits for the send queue, nothing is written after it.
+        if self._close_sent:
+            return
+
+        if frame.opcode & 0x8:
+            if frame.opcode is WebSocketOpcode.CLOSE and self._send_queue:
+                return self._send_queue.append(frame)
+
+            return self._send_frame(frame)
+
+        if frame.opcode is WebSocketOpcode.CONTINUATION:
+            if frame.fin:
+                self._send_fragmented = False
+                self._queue_frame(frame)
+                return self._release_held_frames()
+        elif self._send_fragmented:
+            return self._hold_frame(frame)
+        elif not frame.fin:
+            self._send_fragmented = True
+
+        self._queue_frame(frame)
+
+    def _queue_frame(self, frame):
+        queue = self._send_queue
+
+        if not queue and not self._paused and len(frame.data) <= FRAGMENT_SIZE:
+            return self._send_frame(frame)
+
+        if queue is None:
+            queue = self._send_queue = collections.deque()
+
+        queue.append(frame)
+        self._flush_send_queue()
+
+        if queue and queue[-1] is frame and not isinstance(frame.data, bytes):
+            # Written later, after the caller may have reused its buffer
+            frame.data = bytes(frame.data)
+
+    def _send_frame(self, frame):
+        if self.stats is not None:
+            self.stats.frame_sent(frame.opcode, len(frame.data))
+
+        self._write(frame.serialize_parts(masked=self.client.masked))
+
+    def _flush_send_queue(self, force=False):
+        # Writes queued data frames until the transport pauses, or all of
+        # them with force. Larger frames are split into FRAGMENT_SIZE
+        # fragments, so that pings and pongs never wait for more than one
+        # fragment to be written. A queued CLOSE frame is written last.
+        queue = self._send_queue
+
+        while queue and (force or not self._paused):
+            frame = queue[0]
+            length = len(frame.data)
+            start = self._send_offset
+            end = start + FRAGMENT_SIZE
+
+            if start == 0 and length <= FRAGMENT_SIZE:
+                queue.popleft()
+                self._send_frame(frame)
+                continue
+
+            if end >= length:
+                queue.popleft()
+                self._send_offset = 0
+            else:
+                self._send_offset = end
+
+            self._send_frame(
+                WebSocketFrame(
+                    opcode=frame.opcode if start == 0 else WebSocketOpcode.CONTINUATION,
+                    fin=frame.fin and end >= length, rsv1=frame.rsv1 and start == 0,
+                    data=memoryview(frame.data)[start:end]
+                )
+            )
+
+    def _hold_frame(self, frame):
+        if self._held_frames is None:
+            self._held_frames = collections.deque()
+
+        if not isinstance(frame.data, bytes):
+            frame.data = bytes(frame.data)
+
+        self._held_frames.append(frame)
+
+    def _release_held_frames(self):
+        held = self._held_frames
+
+        # A held frame may start another fragmented message
+        while held and not self._send_fragmented:
+            self._write_frame(held.popleft())
+
+        if not held:
+            self._release_held_waiter()
+
+    def _release_held_waiter(self):
+        waiter = self._held_waiter
+
+        if waiter is not None:
+            self._held_waiter = None
+
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _discard_send_queue(self):
+        # Used when the connection is aborted or lost
+        if self._send_queue:
+            self._send_queue.clear()
+            self._send_offset = 0
+
+    def set_cork_delay(self, delay):
+        # With a delay, writes are gathered and flushed with a single
+        # writelines() call, delay=0 flushes at the end of the current
+        # event loop iteration. None writes straight to the transport.
+        self._cork_delay = delay
+
+        if delay is None and self._batch_depth == 0:
+            self.flush()
+
+    @contextlib.contextmanager
+    def batch(self):
+        # Gathers every write made inside the block into one writelines()
+        self._batch_depth += 1
+
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+
+            if self._batch_depth == 0:
+                self.flush()
+
+    def _write(self, buffers):
+        if self._cork_delay is None and self._batch_depth == 0:
+            return self.transport.writelines(buffers)
+
+        if self._cork_buffers is None:
+            self._cork_buffers = []
+
+        start = len(self._cork_buffers)
+        self._cork_buffers.extend(buffers)
+        self._cork_size += sum(len(buffer) for buffer in self._cork_buffers[start:])
+
+        # Corked bytes are invisible to flow control, they are written as
+        # soon as they would fill the transport's buffer on their own.
+        if self._cork_size > self.transport.get_write_buffer_limits()[1]:
+            return self.flush()
+
+        if self._batch_depth == 0 and self._cork_handle is None:
+            if self._cork_delay:
+                self._cork_handle = self.loop.call_later(self._cork_delay, self.flush)
+            else:
+                self._cork_handle = self.loop.call_soon(self.flush)
+
+    def flush(self):
+        if self._cork_handle is not None:
+            self._cork_handle.cancel()
+            self._cork_handle = None
+
+        buffers = self._cork_buffers
+
+        if buffers and self.transport is not None and not self.transport.is_closing():
+            self._cork_buffers = None
+            self._cork_size = 0
+            self.transport.writelines(buffers)
+
     def close(self, exc=None):
+        # The transport writes whatever it buffered before closing, the send
+        # queue is handed to it first.
+        if self.transport is not None and not self.transport.is_closing():
+            self._flush_send_queue(force=True)
+
+        self.flush()
+
         self.state = WebSocketProtocolState.CLOSED
         self._run_callback('connection_closing', exc)
 
         if self.transport is not None:
             self.transport.close()
+
+    def abort(self, exc=None):
+        # Closes the transport right away, discarding anything not written yet
+        self._close_handle = None
+        self._discard_send_queue()
+
+        if self.state is not WebSocketProtocolState.CLOSED:
+            self.state = WebSocketProtocolState.CLOSED
+            self._run_callback('connection_closing', exc)
+
+        if self.transport is not None:
+            self.transport.abort()
+
+
+class BufferedWebSocketProtocol(WebSocketProtocol, asyncio.BufferedProtocol):
+    # Reads straight into the frame parser's receive buffer once the
+    # handshake is complete, the handshake itself is read into a small
+    # buffer owned by the protocol and fed to the HTTP parser.
+    __slots__ = ('_handshake_buffer', '_read_buffer')
+
+    def __init__(self, client, *, handshake_buffer_size=4096):
+        super().__init__(client)
+
+        self._handshake_buffer = memoryview(bytearray(handshake_buffer_size))
+        self._read_buffer = None
+
+    def get_buffer(self, sizehint):
+        if self._parser is not None and not inspect.isgenerator(self._parser):
+            self._read_buffer = self._parser.get_buffer(sizehint)
+        else:
+            self._read_buffer = self._handshake_buffer
+
+        return self._read_buffer
+
+    def buffer_updated(self, nbytes):
+        if self._read_buffer is self._handshake_buffer:
+            return self.data_received(bytes(self._read_buffer[:nbytes]))
+
+        # The view is only valid until the callback returns, masked
+        # payloads are unmasked in place and the buffer is compacted.
+        self._run_callback('data_received', self._read_buffer[:nbytes])
+
+        state = self.state
+        stats = self.stats
+
+        if stats is not None:
+            started = time.perf_counter()
+
+        self.state = WebSocketProtocolState.PARSING
+
+        try:
+            self._parser.buffer_updated(nbytes)
+        except Exception as err:
+            self._run_callback('parser_failed', err)
+
+        self._restore_state(state)
+
+        if stats is not None:
+            stats.parser_ran(time.perf_counter() - started)
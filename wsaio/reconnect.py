@@ -0,0 +1,108 @@
+import asyncio
+import random
+
+from .exceptions import WsaioError
+
+
+class WebSocketReconnector:
+    # Keeps a WebSocketClient connected, reconnecting the same instance
+    # whenever the connection is lost or an attempt fails. Delays grow
+    # exponentially up to max_delay and are drawn uniformly from [0, delay)
+    # ("full jitter") so that clients dropped at the same moment do not all
+    # come back at the same moment.
+    def __init__(
+        self, client, url, *args, min_delay=0.5, max_delay=30.0, factor=2.0,
+        max_attempts=None, timeout=None, **kwargs
+    ):
+        self.client = client
+        self.loop = client.loop
+        self.url = url
+        self.args = args
+        self.kwargs = kwargs
+
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+
+        # The failed attempts since the last successful connection
+        self.attempts = 0
+        self.connections = 0
+
+        self._task = None
+        self._connected = None
+        self._configured = False
+
+    def get_delay(self):
+        delay = min(self.max_delay, self.min_delay * self.factor ** self.attempts)
+        return random.uniform(0, delay)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._connected = self.loop.create_future()
+            self._task = self.loop.create_task(self.run())
+
+        return self._task
+
+    async def wait_connected(self):
+        # Waits until the first connection is made
+        await asyncio.shield(self._connected)
+
+    async def stop(self):
+        task = self._task
+
+        if task is None:
+            return
+
+        self._task = None
+        task.cancel()
+
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+        if self.client.protocol is not None:
+            self.client.protocol.close()
+
+    async def _connect(self):
+        if not self._configured:
+            # connect() stores the options even if the attempt fails
+            self._configured = True
+            connect = self.client.connect(self.url, *self.args, **self.kwargs)
+        else:
+            connect = self.client.reconnect()
+
+        try:
+            await asyncio.wait_for(connect, self.timeout)
+        except asyncio.TimeoutError:
+            if self.client.protocol is not None:
+                self.client.protocol.close()
+            raise
+
+    async def run(self):
+        while True:
+            try:
+                await self._connect()
+            except (OSError, asyncio.TimeoutError, WsaioError) as exc:
+                self.attempts += 1
+
+                if self.max_attempts is not None and self.attempts >= self.max_attempts:
+                    if not self._connected.done():
+                        self._connected.set_exception(exc)
+                    raise
+
+                await asyncio.sleep(self.get_delay())
+                continue
+
+            self.attempts = 0
+            self.connections += 1
+
+            if not self._connected.done():
+                self._connected.set_result(None)
+
+            await self.client.wait_closed()
+
+            # Connections lost at the same time are spread out as well
+            await asyncio.sleep(self.get_delay())
@@ -0,0 +1,63 @@
+import json
+
+from .websocket import WebSocketOpcode
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Serializer:
+    # dumps() returns bytes that are written to the frame as they are and
+    # loads() takes the raw payload (bytes, bytearray or memoryview), so no
+    # intermediate str is built on either side. Messages are sent and
+    # received with opcode.
+    opcode = WebSocketOpcode.TEXT
+
+    def dumps(self, obj):
+        raise NotImplementedError
+
+    def loads(self, data):
+        raise NotImplementedError
+
+
+class JSONSerializer(Serializer):
+    # The stdlib fallback, json.dumps() can only produce a str
+    def dumps(self, obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode()
+
+    def loads(self, data):
+        if isinstance(data, memoryview):
+            data = bytes(data)
+
+        return json.loads(data)
+
+
+class OrjsonSerializer(Serializer):
+    def dumps(self, obj):
+        return orjson.dumps(obj)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+class MsgpackSerializer(Serializer):
+    opcode = WebSocketOpcode.BINARY
+
+    def dumps(self, obj):
+        return msgpack.packb(obj)
+
+    def loads(self, data):
+        return msgpack.unpackb(data)
+
+
+if orjson is not None:
+    JSON_SERIALIZER = OrjsonSerializer()
+else:
+    JSON_SERIALIZER = JSONSerializer()
@@ -0,0 +1,255 @@
+import asyncio
+import copy
+from http import HTTPStatus
+
+from .broadcast import broadcast, close_all
+from .client import BaseWebSocketClient
+from .exceptions import BrokenHandshakeError, WsaioError
+from .extensions import PerMessageDeflate, parse_extensions
+from .http import HTTPRequest, HTTPResponse
+from .pool import BUFFER_POOL
+from .protocol import (
+    CLOSE_TIMEOUT,
+    BufferedWebSocketProtocol,
+    WebSocketProtocol,
+    WebSocketProtocolState,
+)
+from .serializers import JSON_SERIALIZER
+from .stats import aggregate_stats
+from .websocket import MAX_MESSAGE_SIZE, WebSocketCloseCode, get_accept_key
+
+
+def _server_setting(name):
+    return property(lambda self: getattr(self.server, name))
+
+
+class WebSocketServerClient(BaseWebSocketClient):
+    # The server end of a single connection, WebSocketServer creates one
+    # per accepted connection. Subclasses implement the same callbacks as
+    # WebSocketClient subclasses, but have to call super() if they override
+    # connection_made or connection_lost.
+    masked = False
+
+    # The connection settings are shared with the server rather than copied
+    # per connection, compression is set once it has been negotiated.
+    receive_limits = _server_setting('receive_limits')
+    cork_delay = _server_setting('cork_delay')
+    close_timeout = _server_setting('close_timeout')
+    heartbeat = _server_setting('heartbeat')
+    collect_stats = _server_setting('collect_stats')
+
+    zero_copy = _server_setting('zero_copy')
+    max_frame_size = _server_setting('max_frame_size')
+    max_message_size = _server_setting('max_message_size')
+    offload_threshold = _server_setting('offload_threshold')
+    executor = _server_setting('executor')
+    message_transform = _server_setting('message_transform')
+    serializer = _server_setting('serializer')
+    buffer_pool = _server_setting('buffer_pool')
+
+    def __init__(self, server):
+        super().__init__(server.loop)
+        self.server = server
+        self.request = None
+
+    def connection_made(self, transport):
+        self.protocol.set_parser(HTTPRequest.parser(self.protocol))
+        self.protocol.state = WebSocketProtocolState.HANDSHAKING
+
+        self.server.clients.add(self)
+
+    def connection_lost(self, exc):
+        self.server.clients.discard(self)
+
+    def handshake_failed(self, exc):
+        if self.protocol.transport.is_closing():
+            return
+
+        status = HTTPStatus.BAD_REQUEST
+        headers = {}
+
+        if isinstance(exc, WsaioError):
+            status = exc.get_extra('status', status)
+            headers = exc.get_extra('headers', headers)
+
+        self.protocol.transport.write(
+            HTTPResponse(status=status, phrase=status.phrase, headers=headers, body=b'').serialize()
+        )
+
+    def http_request_received(self, request):
+        self.request = request
+
+        extra = {
+            'request': request,
+            'protocol': self
+        }
+
+        try:
+            headers = self._validate_request(request, extra)
+        except BrokenHandshakeError as exc:
+            self.handshake_failed(exc)
+            return self.protocol.close(exc)
+
+        self.protocol.transport.write(
+            HTTPResponse(
+                status=HTTPStatus.SWITCHING_PROTOCOLS,
+                phrase=HTTPStatus.SWITCHING_PROTOCOLS.phrase,
+                headers=headers,
+                body=b''
+            ).serialize()
+        )
+
+        self.protocol.state = WebSocketProtocolState.IDLE
+        self.protocol.set_parser(self._create_frame_parser())
+        self._start_heartbeat()
+
+        self.protocol._run_callback('ws_connected')
+
+    def _validate_request(self, request, extra):
+        if request.method != 'GET':
+            raise BrokenHandshakeError(
+                f'Client sent a {request.method} request, need GET to complete handshake. '
+                f'Closing!',
+                dict(extra, status=HTTPStatus.METHOD_NOT_ALLOWED)
+            )
+
+        connection = request.headers.getone(b'connection')
+
+        if connection is None or b'upgrade' not in (
+            item.strip() for item in connection.lower().split(b',')
+        ):
+            raise BrokenHandshakeError(
+                f'Client sent "connection: {connection}", '
+                f'need "connection: upgrade" to complete handshake. '
+                f'Closing!',
+                extra
+            )
+
+        upgrade = request.headers.getone(b'upgrade')
+
+        if upgrade is None or upgrade.lower() != b'websocket':
+            raise BrokenHandshakeError(
+                f'Client sent "upgrade: {upgrade}", '
+                f'need "upgrade: websocket" to complete handshake. '
+                f'Closing!',
+                extra
+            )
+
+        version = request.headers.getone(b'sec-websocket-version')
+
+        if version != b'13':
+            raise BrokenHandshakeError(
+                f'Client sent "sec-websocket-version: {version}", '
+                f'need "sec-websocket-version: 13" to complete handshake. '
+                f'Closing!',
+                dict(
+                    extra, status=HTTPStatus.UPGRADE_REQUIRED,
+                    headers={'Sec-WebSocket-Version': '13'}
+                )
+            )
+
+        key = request.headers.getone(b'sec-websocket-key')
+
+        if key is None:
+            raise BrokenHandshakeError(
+                'Client did not send "sec-websocket-key". Closing!', extra
+            )
+
+        headers = {
+            'Connection': 'Upgrade',
+            'Upgrade': 'websocket',
+            'Sec-WebSocket-Accept': get_accept_key(key).decode()
+        }
+
+        if self.server.compression is not None:
+            extensions = parse_extensions(request.headers.get(b'sec-websocket-extensions', ()))
+
+            for name, params in extensions:
+                if name != PerMessageDeflate.name:
+                    continue
+
+                compression = copy.copy(self.server.compression)
+                response = compression.negotiate(params)
+
+                if response is not None:
+                    self.compression = compression
+                    self.protocol.extensions.append(compression)
+                    headers['Sec-WebSocket-Extensions'] = response
+                    break
+
+        return headers
+
+
+class WebSocketServer:
+    def __init__(
+        self, client_class=WebSocketServerClient, *, loop=None, compression=None,
+        zero_copy=False, buffered=False, receive_limits=None, cork_delay=None, heartbeat=None,
+        collect_stats=False, max_frame_size=None, max_message_size=MAX_MESSAGE_SIZE,
+        offload_threshold=None, executor=None, message_transform=None,
+        serializer=JSON_SERIALIZER, buffer_pool=BUFFER_POOL, close_timeout=CLOSE_TIMEOUT
+    ):
+        if loop is not None:
+            self.loop = loop
+        else:
+            self.loop = asyncio.get_event_loop()
+
+        self.client_class = client_class
+
+        if compression is True:
+            compression = PerMessageDeflate()
+
+        self.compression = compression
+        self.zero_copy = zero_copy
+        self.receive_limits = receive_limits
+        self.cork_delay = cork_delay
+        self.close_timeout = close_timeout
+        self.heartbeat = heartbeat
+        self.collect_stats = collect_stats
+        self.max_frame_size = max_frame_size
+        self.max_message_size = max_message_size
+        self.offload_threshold = offload_threshold
+        self.executor = executor
+        self.message_transform = message_transform
+        self.serializer = serializer
+        self.buffer_pool = buffer_pool
+
+        if buffered:
+            self.protocol_class = BufferedWebSocketProtocol
+        else:
+            self.protocol_class = WebSocketProtocol
+
+        self.server = None
+        self.clients = set()
+
+    def _create_protocol(self):
+        return self.client_class(self)._create_protocol(self.protocol_class)
+
+    async def listen(self, host=None, port=None, *, reuse_port=False, backlog=1024, **kwargs):
+        # reuse_port lets several worker processes listen on the same port,
+        # the kernel then balances new connections between them.
+        self.server = await self.loop.create_server(
+            self._create_protocol, host, port, reuse_port=reuse_port, backlog=backlog, **kwargs
+        )
+
+    async def listen_unix(self, path=None, *, backlog=1024, **kwargs):
+        self.server = await self.loop.create_unix_server(
+            self._create_protocol, path, backlog=backlog, **kwargs
+        )
+
+    def get_stats(self):
+        # The stats of every connected client merged into one ConnectionStats
+        return aggregate_stats(self.clients)
+
+    def broadcast(self, frame, **kwargs):
+        return broadcast(self.clients, frame, **kwargs)
+
+    def close_all(self, code=WebSocketCloseCode.GOING_AWAY, reason=b'', **kwargs):
+        return close_all(self.clients, code, reason, **kwargs)
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+
+    async def wait_closed(self):
+        if self.server is not None:
+            await self.server.wait_closed()
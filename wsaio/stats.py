@@ -0,0 +1,135 @@
+from .websocket import WebSocketOpcode
+
+# The stats of live connections, aggregate_stats() merges these by default
+live_stats = set()
+
+_COUNTERS = (
+    'parser_calls', 'parser_time', 'parser_max_time', 'pause_writing_count',
+    'resume_writing_count', 'drain_count', 'drain_time', 'callback_tasks'
+)
+
+
+class ConnectionStats:
+    # Counters for one protocol, only updated while protocol.stats is set.
+    # The per opcode lists are indexed by the opcode's value.
+    __slots__ = (
+        'protocol', 'frames_received', 'bytes_received', 'frames_sent', 'bytes_sent',
+        *_COUNTERS
+    )
+
+    def __init__(self, protocol=None):
+        self.protocol = protocol
+
+        self.frames_received = [0] * 16
+        self.bytes_received = [0] * 16
+        self.frames_sent = [0] * 16
+        self.bytes_sent = [0] * 16
+
+        # Time is measured with time.perf_counter()
+        self.parser_calls = 0
+        self.parser_time = 0.0
+        self.parser_max_time = 0.0
+
+        self.pause_writing_count = 0
+        self.resume_writing_count = 0
+
+        self.drain_count = 0
+        self.drain_time = 0.0
+
+        # The task based callbacks (e.g. ws_connected) that have not finished
+        self.callback_tasks = 0
+
+    def frame_received(self, opcode, length):
+        self.frames_received[opcode] += 1
+        self.bytes_received[opcode] += length
+
+    def frame_sent(self, opcode, length):
+        self.frames_sent[opcode] += 1
+        self.bytes_sent[opcode] += length
+
+    def parser_ran(self, elapsed):
+        self.parser_calls += 1
+        self.parser_time += elapsed
+
+        if elapsed > self.parser_max_time:
+            self.parser_max_time = elapsed
+
+    def callback_task_done(self, task):
+        self.callback_tasks -= 1
+
+    def get_pending_callbacks(self):
+        # Queued message callbacks plus unfinished callback tasks
+        pending = self.callback_tasks
+
+        if self.protocol is not None:
+            pending += self.protocol.get_pending_size()[1]
+
+        return pending
+
+    def merge(self, other):
+        for name in ('frames_received', 'bytes_received', 'frames_sent', 'bytes_sent'):
+            totals = getattr(self, name)
+
+            for opcode, value in enumerate(getattr(other, name)):
+                totals[opcode] += value
+
+        for name in _COUNTERS:
+            if name == 'parser_max_time':
+                self.parser_max_time = max(self.parser_max_time, other.parser_max_time)
+            else:
+                setattr(self, name, getattr(self, name) + getattr(other, name))
+
+        # Aggregates have no protocol, their count includes the queued callbacks
+        if other.protocol is not None:
+            self.callback_tasks += other.protocol.get_pending_size()[1]
+
+    def as_dict(self):
+        # Only opcodes that were seen, keyed by name where the opcode is known
+        def by_opcode(values):
+            result = {}
+
+            for opcode, value in enumerate(values):
+                if value:
+                    try:
+                        result[WebSocketOpcode(opcode).name] = value
+                    except ValueError:
+                        result[opcode] = value
+
+            return result
+
+        stats = {
+            'frames_received': by_opcode(self.frames_received),
+            'bytes_received': by_opcode(self.bytes_received),
+            'frames_sent': by_opcode(self.frames_sent),
+            'bytes_sent': by_opcode(self.bytes_sent),
+        }
+
+        for name in _COUNTERS:
+            stats[name] = getattr(self, name)
+
+        stats['pending_callbacks'] = self.get_pending_callbacks()
+
+        return stats
+
+
+def aggregate_stats(protocols=None):
+    # Merges the stats of protocols (by default every live connection that
+    # collects stats) into a new ConnectionStats. Clients are accepted in
+    # place of their protocols.
+    total = ConnectionStats()
+
+    if protocols is None:
+        stats = list(live_stats)
+    else:
+        stats = []
+
+        for protocol in protocols:
+            protocol = getattr(protocol, 'protocol', protocol)
+
+            if protocol is not None and protocol.stats is not None:
+                stats.append(protocol.stats)
+
+    for item in stats:
+        total.merge(item)
+
+    return total
@@ -1,4 +1,134 @@
+RECEIVE_BUFFER_SIZE = 1 << 16
+
+
+def noop_callback(func):
+    # Marks a callback that does nothing unless a subclass overrides it,
+    # the protocol skips these instead of calling them for every frame.
+    func._noop_callback = True
+    return func
+
+
 def ensure_length(data, length):
-    while length > len(data):
-        data += yield
+    # Collects at least length bytes in a bytearray, appending to bytes
+    # would copy everything received so far for every chunk.
+    if length > len(data):
+        data = bytearray(data)
+
+        while length > len(data):
+            data += yield
+
+        data = bytes(data)
+
     return data
+
+
+class ReceiveBuffer:
+    # A growable buffer with a read offset (start) and a write offset (end).
+    # Consumed data is only moved when room is needed for more, so feeding
+    # a frame in many chunks or many frames in one chunk stays linear.
+    #
+    # With a pool (see pool.py) buffers are borrowed from it and charged to
+    # owner, and given back whenever everything has been consumed, so idle
+    # connections hold no receive buffer at all.
+    def __init__(self, size=RECEIVE_BUFFER_SIZE, *, pool=None, owner=None):
+        self.size = size
+        self.pool = pool
+        self.owner = owner
+
+        if pool is None:
+            self.buffer = bytearray(size)
+            self.view = memoryview(self.buffer)
+        else:
+            self.buffer = None
+            self.view = None
+
+        self.start = 0
+        self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def reserve(self, size):
+        # Makes room for at least size bytes after end. This may move the
+        # unread data to the front of the buffer, so views returned by
+        # earlier calls to get_buffer() or taken of consumed data are invalid
+        # afterwards.
+        capacity = len(self.buffer) if self.buffer is not None else 0
+
+        if self.end + size <= capacity:
+            return
+
+        unread = self.end - self.start
+
+        if unread + size <= capacity:
+            unread_data = self.view[self.start:self.end]
+
+            # The copy below is a memcpy, overlapping regions need a temporary.
+            if unread > self.start:
+                unread_data = bytes(unread_data)
+
+            self.buffer[:unread] = unread_data
+        else:
+            buffer = self._allocate(max(capacity * 2, self.size, unread + size))
+
+            if unread:
+                buffer[:unread] = self.view[self.start:self.end]
+
+            self._free()
+
+            self.buffer = buffer
+            self.view = memoryview(buffer)
+
+        self.start = 0
+        self.end = unread
+
+    def get_buffer(self, sizehint):
+        # sizehint is -1 or 0 when the transport has no preference, reads
+        # are never smaller than a quarter of the initial size regardless.
+        self.reserve(max(sizehint, self.size >> 2))
+        return self.view[self.end:]
+
+    def buffer_updated(self, size):
+        self.end += size
+
+    def extend(self, data):
+        size = len(data)
+        self.reserve(size)
+
+        self.buffer[self.end:self.end + size] = data
+        self.end += size
+
+    def consume(self, size):
+        start = self.start
+        self.start += size
+        return self.view[start:self.start]
+
+    def reset(self):
+        # Called once everything has been consumed, buffers that grew to hold
+        # a large frame are given back instead of being kept around forever.
+        self.start = 0
+        self.end = 0
+
+        if self.pool is not None:
+            self.release()
+        elif len(self.buffer) > self.size * 4:
+            self.buffer = bytearray(self.size)
+            self.view = memoryview(self.buffer)
+
+    def release(self):
+        self._free()
+
+        self.buffer = None
+        self.view = None
+        self.start = 0
+        self.end = 0
+
+    def _allocate(self, size):
+        if self.pool is None:
+            return bytearray(size)
+
+        return self.pool.acquire(size, self.owner)
+
+    def _free(self):
+        if self.pool is not None and self.buffer is not None:
+            self.pool.release(self.buffer, self.owner)
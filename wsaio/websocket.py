@@ -1,9 +1,22 @@
+import base64
+import codecs
+import collections
 import enum
-import os
+import hashlib
 import struct
+import zlib
 
 from .exceptions import ParserInvalidDataError
-from .utils import ensure_length
+from .extensions import PerMessageDeflate
+from .mask import apply_mask, generate_mask
+from .utils import RECEIVE_BUFFER_SIZE, ReceiveBuffer
+
+
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+def get_accept_key(key):
+    return base64.b64encode(hashlib.sha1(key + WEBSOCKET_GUID).digest())
 
 
 class WebSocketOpcode(enum.IntEnum):
@@ -22,6 +35,12 @@ CONTROL_OPCODES = (
 )
 
 
+DATA_OPCODES = (
+    WebSocketOpcode.TEXT,
+    WebSocketOpcode.BINARY,
+)
+
+
 class WebSocketCloseCode(enum.IntEnum):
     # 0 - 999 NOT USED
     NORMAL_CLOSURE = 1000
@@ -43,6 +62,8 @@ class WebSocketCloseCode(enum.IntEnum):
 
 
 class WebSocketFrame:
+    __slots__ = ('opcode', 'fin', 'rsv1', 'rsv2', 'rsv3', 'data')
+
     SHORT_LENGTH = struct.Struct('!H')
     LONGLONG_LENGTH = struct.Struct('!Q')
 
@@ -59,16 +80,9 @@ class WebSocketFrame:
         formatted = ', '.join(f'{name}={getattr(self, name)!r}' for name in attrs)
         return f'<{self.__class__.__name__} {formatted}>'
 
-    @staticmethod
-    def apply_mask(data, mask):
-        data = bytearray(data)
-
-        for i in range(len(data)):
-            data[i] ^= mask[i % 4]
+    apply_mask = staticmethod(apply_mask)
 
-        return data
-
-    def serialize(self, masked=False):
+    def serialize_header(self, mask=None):
         buffer = bytearray(2)
         buffer[0] = (
             (self.fin << 7)
@@ -77,7 +91,7 @@ class WebSocketFrame:
             | (self.rsv3 << 4)
             | self.opcode
         )
-        buffer[1] = masked << 7
+        buffer[1] = (mask is not None) << 7
 
         length = len(self.data)
         if length < 126:
@@ -89,136 +103,640 @@ class WebSocketFrame:
             buffer[1] |= 127
             buffer.extend(self.LONGLONG_LENGTH.pack(length))
 
-        if masked:
-            mask = os.urandom(4)
+        if mask is not None:
             buffer.extend(mask)
-            data = self.apply_mask(self.data, mask)
-        else:
-            data = self.data
 
-        buffer.extend(data)
+        return buffer
+
+    def serialize(self, masked=False):
+        if masked:
+            mask = generate_mask()
+            buffer = self.serialize_header(mask)
+            self.apply_mask(self.data, mask, buffer, len(buffer))
+        else:
+            buffer = self.serialize_header()
+            buffer.extend(self.data)
 
         return buffer
 
+    def serialize_parts(self, masked=False):
+        # Returns the buffers to pass to transport.writelines(), unmasked
+        # payloads are passed along as is instead of being copied after
+        # the header. Masking has to copy the payload anyway, so masked
+        # frames are still serialized into a single buffer.
+        if masked:
+            return (self.serialize(masked=True),)
+
+        return (self.serialize_header(), self.data)
+
     @classmethod
     def parser(cls, protocol):
-        data = yield
-        position = 0
-        fragmented_frame = None
-        fragment_buffer = bytearray()
+        parser = WebSocketFrameParser(protocol)
 
         while True:
-            data = data[position:]
-            position = 0
+            parser.feed((yield))
+
+
+def _is_valid_close_code(code):
+    # The codes a CLOSE frame may carry (RFC 6455 7.4), 1005, 1006 and 1015
+    # only report a closure without one and 1016 - 2999 are unassigned.
+    return 1000 <= code <= 1003 or 1007 <= code <= 1014 or 3000 <= code <= 4999
+
+
+def _decode_first_byte(fbyte):
+    try:
+        opcode = WebSocketOpcode(fbyte & 0xF)
+    except ValueError:
+        return None
+
+    return opcode, bool(fbyte & 0x80), bool(fbyte & 0x40), bool(fbyte & 0x20), bool(fbyte & 0x10)
+
+
+def _decode_second_byte(sbyte):
+    masked = bool(sbyte & 0x80)
+    length = sbyte & 0x7F
+
+    if length == 126:
+        strct = WebSocketFrame.SHORT_LENGTH
+    elif length == 127:
+        strct = WebSocketFrame.LONGLONG_LENGTH
+    else:
+        strct = None
+
+    header_length = 2
+
+    if strct is not None:
+        header_length += strct.size
+
+    if masked:
+        header_length += 4
+
+    return masked, length, header_length, strct
+
+
+# The first two header bytes decoded for every possible value. The first
+# gives (opcode, fin, rsv1, rsv2, rsv3), or None for reserved opcodes, and
+# the second (masked, length, header length, extended length struct).
+FIRST_BYTE_TABLE = tuple(_decode_first_byte(i) for i in range(256))
+SECOND_BYTE_TABLE = tuple(_decode_second_byte(i) for i in range(256))
+
+
+# The default size of the frames streamed messages are split into
+FRAGMENT_SIZE = 1 << 18
+
+# The default limit for the size of a (reassembled) message
+MAX_MESSAGE_SIZE = 1 << 26
+
+# The most bytes reserved ahead for the rest of a frame that has not arrived
+# yet, larger frames grow the buffer as their payload is received.
+RESERVE_AHEAD = 1 << 20
+
+
+class WebSocketFrameParser:
+    # Parses every complete frame in the receive buffer per call to feed() or
+    # buffer_updated(). Payloads are copied out of the buffer exactly once,
+    # or handed out as memoryview slices of it if zero_copy is set. Those
+    # views are only valid until the callback they are passed to returns.
+    #
+    # If the client implements ws_fragment_received, data messages are
+    # streamed to it one frame at a time instead of being reassembled.
+    #
+    # transform(opcode, data) is applied to every message before it is
+    # passed to ws_text_received or ws_binary_received. Decoding and the
+    # transform run in executor for messages of at least offload_threshold
+    # bytes, later messages are held back until the result is delivered.
+    #
+    # If the client implements ws_object_received, messages with the
+    # serializer's opcode are passed to serializer.loads() as raw bytes and
+    # the result to ws_object_received instead.
+    #
+    # With a buffer_pool the receive buffer is borrowed from it and the
+    # protocol is charged for the receive buffer and fragmented messages.
+    def __init__(
+        self, protocol, *, buffer_size=RECEIVE_BUFFER_SIZE, zero_copy=False, server_side=False,
+        max_frame_size=None, max_message_size=MAX_MESSAGE_SIZE, offload_threshold=None,
+        executor=None, transform=None, serializer=None, buffer_pool=None
+    ):
+        self.protocol = protocol
+        self.buffer_pool = buffer_pool
+        self.buffer = ReceiveBuffer(buffer_size, pool=buffer_pool, owner=protocol)
+        self.zero_copy = zero_copy
+        self.server_side = server_side
+
+        self.offload_threshold = offload_threshold
+        self.executor = executor
+        self.transform = transform
+
+        if protocol.has_callback('ws_object_received'):
+            self.serializer = serializer
+        else:
+            self.serializer = None
+
+        # (fbyte, opcode, future or None, data, size) for the messages waiting
+        # behind an offloaded one, size is the length of the received payload.
+        # A CLOSE frame waits there too, its data is (code, reason).
+        self.pending = None
+
+        # Set once the peer's CLOSE frame was parsed, the pending messages
+        # are still delivered if the connection is lost after that.
+        self.close_received = False
+
+        self.max_frame_size = max_frame_size
+        self.max_message_size = max_message_size
+
+        self.fragmented_opcode = None
+        self.fragment_buffer = bytearray()
+
+        # Fragmented text is decoded as it arrives, text_remainder holds the
+        # start of a character that was split between two frames. text_size
+        # is the payload size of the fragments, charged to the buffer pool.
+        self.text_fragments = []
+        self.text_remainder = b''
+        self.text_size = 0
+
+        # The number of payload bytes received and delivered for the current message
+        self.message_length = 0
+        self.message_size = 0
+
+        # Frame objects are only built for a ws_frame_received callback
+        self.frame_callback = protocol.has_callback('ws_frame_received')
+        self.streaming = protocol.has_callback('ws_fragment_received')
+
+        self.deflate = None
+        self.compressed = False
+
+        for extension in protocol.extensions:
+            if isinstance(extension, PerMessageDeflate):
+                self.deflate = extension
+
+    def get_buffer(self, sizehint):
+        return self.buffer.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes):
+        self.buffer.buffer_updated(nbytes)
+        self.parse()
+
+    def feed(self, data):
+        self.buffer.extend(data)
+        self.parse()
+
+    def parse(self):
+        buffer = self.buffer
+        stats = self.protocol.stats
+
+        while True:
+            data = buffer.buffer
+            position = buffer.start
+            available = buffer.end - position
+
+            if available < 2:
+                break
 
-            data = yield from ensure_length(data, position + 1)
             fbyte = data[position]
-            position += 1
 
-            data = yield from ensure_length(data, position + 1)
-            sbyte = data[position]
-            position += 1
+            if FIRST_BYTE_TABLE[fbyte] is None:
+                raise self.invalid_data(
+                    f'Received frame with reserved opcode {fbyte & 0xF:#x}',
+                    WebSocketCloseCode.PROTOCOL_ERROR, fbyte, b''
+                )
 
-            masked = (sbyte >> 7) & 1
-            length = sbyte & ~(1 << 7)
+            masked, length, header_length, strct = SECOND_BYTE_TABLE[data[position + 1]]
 
-            if length > 125:
-                if length == 126:
-                    strct = cls.SHORT_LENGTH
-                elif length == 127:
-                    strct = cls.LONGLONG_LENGTH
+            if self.server_side and not masked:
+                extra = {
+                    'protocol': self.protocol,
+                    'close_code': WebSocketCloseCode.PROTOCOL_ERROR
+                }
+                raise ParserInvalidDataError('Received unmasked frame from client', extra)
 
-                data = yield from ensure_length(data, position + strct.size)
-                length, = strct.unpack_from(data, position)
-                position += strct.size
+            if available < header_length:
+                break
 
-            if masked:
-                data = yield from ensure_length(data, position + 4)
-                mask = data[position:position + 4]
-                position += 4
+            if strct is not None:
+                length, = strct.unpack_from(data, position + 2)
 
-            data = yield from ensure_length(data, position + length)
-            payload = data[position:position + length]
-            position += length
+            self.check_length(fbyte, length)
+
+            if available < header_length + length:
+                # Make room for the rest of the frame now so that it can be
+                # appended without moving the buffer again. Only a bounded
+                # amount is reserved, the declared length is up to the peer.
+                buffer.reserve(min(header_length + length - available, RESERVE_AHEAD))
+                break
+
+            buffer.start += header_length
+            payload = buffer.consume(length)
 
             if masked:
-                payload = cls.mask(data, mask)
+                mask = data[buffer.start - length - 4:buffer.start - length]
+                apply_mask(payload, mask, data, buffer.start - length)
+
+            if not self.zero_copy:
+                payload = bytes(payload)
+
+            if stats is not None:
+                stats.frame_received(fbyte & 0xF, length)
+
+            self.frame_received(fbyte, payload)
+
+        if buffer.start == buffer.end:
+            buffer.reset()
+
+    def check_length(self, fbyte, length):
+        # Called with the length from the header, before any of the payload
+        # is buffered.
+        if fbyte & 0x8:
+            if length > 125:
+                raise self.invalid_data(
+                    f'Received control frame with payload length > 125 ({length})',
+                    WebSocketCloseCode.PROTOCOL_ERROR, fbyte, b''
+                )
+            return
+
+        if self.max_frame_size is not None and length > self.max_frame_size:
+            raise self.invalid_data(
+                f'Received frame with payload length {length}, '
+                f'the maximum is {self.max_frame_size}',
+                WebSocketCloseCode.MESSAGE_TOO_BIG, fbyte, b''
+            )
+
+        if self.max_message_size is not None:
+            if fbyte & 0xF == WebSocketOpcode.CONTINUATION:
+                length += self.message_length
+
+            if length > self.max_message_size:
+                raise self.invalid_data(
+                    f'Received message with payload length {length}, '
+                    f'the maximum is {self.max_message_size}',
+                    WebSocketCloseCode.MESSAGE_TOO_BIG, fbyte, b''
+                )
+
+    def invalid_data(self, message, close_code, fbyte, data):
+        # The frame is only built for the error, frame_received works with
+        # the first header byte and the payload.
+        extra = {
+            'frame': WebSocketFrame(
+                opcode=fbyte & 0xF, fin=(fbyte >> 7) & 1, rsv1=(fbyte >> 6) & 1,
+                rsv2=(fbyte >> 5) & 1, rsv3=(fbyte >> 4) & 1, data=data
+            ),
+            'protocol': self.protocol,
+            'close_code': close_code
+        }
+        return ParserInvalidDataError(message, extra)
+
+    def decompress(self, fbyte, data, fin):
+        if not self.compressed:
+            return data
+
+        max_length = 0
+
+        if self.max_message_size is not None:
+            max_length = self.max_message_size - self.message_size + 1
+
+        try:
+            decompressed = self.deflate.decompress(data, fin, max_length)
+        except zlib.error as e:
+            raise self.invalid_data(
+                f'Failed to decompress message: {e}',
+                WebSocketCloseCode.INVALID_PAYLOAD_DATA, fbyte, data
+            )
+
+        if max_length and len(decompressed) >= max_length:
+            raise self.invalid_data(
+                f'Received compressed message larger than {self.max_message_size} bytes',
+                WebSocketCloseCode.MESSAGE_TOO_BIG, fbyte, data
+            )
+
+        return decompressed
+
+    def decode_text(self, fbyte, data, fin):
+        if self.text_remainder:
+            data = self.text_remainder + data
+
+        try:
+            string, consumed = codecs.utf_8_decode(data, 'strict', bool(fin))
+        except UnicodeDecodeError as e:
+            raise self.invalid_data(str(e), WebSocketCloseCode.INVALID_PAYLOAD_DATA, fbyte, data)
+
+        self.text_remainder = bytes(data[consumed:])
+
+        return string
+
+    def frame_received(self, fbyte, data):
+        protocol = self.protocol
+
+        opcode, fin, rsv1, rsv2, rsv3 = FIRST_BYTE_TABLE[fbyte]
+
+        if self.frame_callback:
+            protocol.ws_frame_received(
+                WebSocketFrame(opcode=opcode, fin=fin, rsv1=rsv1, rsv2=rsv2, rsv3=rsv3, data=data)
+            )
+
+        if rsv1 and (self.deflate is None or opcode not in DATA_OPCODES):
+            raise self.invalid_data(
+                'Received rsv1 but permessage-deflate was not negotiated '
+                'or the frame does not start a message',
+                WebSocketCloseCode.PROTOCOL_ERROR, fbyte, data
+            )
 
-            frame = cls(
-                opcode=WebSocketOpcode(fbyte & 0xF), fin=(fbyte >> 7) & 1, rsv1=(fbyte >> 6) & 1,
-                rsv2=(fbyte >> 5) & 1, rsv3=(fbyte >> 4) & 1, data=payload
+        if rsv2 or rsv3:
+            raise self.invalid_data(
+                'Received rsv2 or rsv3 but no extensions that use them '
+                'were negotiated',
+                WebSocketCloseCode.PROTOCOL_ERROR, fbyte, data
             )
 
-            protocol.ws_frame_received(frame)
+        if opcode in CONTROL_OPCODES:
+            if len(data) > 125:
+                raise self.invalid_data(
+                    f'Received control frame with payload length > 125 '
+                    f'({len(data)})',
+                    WebSocketCloseCode.PROTOCOL_ERROR, fbyte, data
+                )
+
+            elif not fin:
+                raise self.invalid_data(
+                    'Received fragmented control frame',
+                    WebSocketCloseCode.PROTOCOL_ERROR, fbyte, data
+                )
+
+            elif opcode is WebSocketOpcode.PING:
+                protocol.ws_ping_received(data)
+
+            elif opcode is WebSocketOpcode.PONG:
+                protocol.ws_pong_received(data)
+
+            elif opcode is WebSocketOpcode.CLOSE:
+                if len(data) == 1:
+                    raise self.invalid_data(
+                        'Received close frame with a 1 byte payload',
+                        WebSocketCloseCode.PROTOCOL_ERROR, fbyte, data
+                    )
 
-            extra = {
-                'frame': frame,
-                'protocol': protocol
-            }
+                close_code = int.from_bytes(data[:2], 'big')
 
-            if not protocol.extensions:
-                if any((frame.rsv1, frame.rsv2, frame.rsv3)):
-                    extra['close_code'] = WebSocketCloseCode.PROTOCOL_ERROR
-                    raise ParserInvalidDataError(
-                        'Received rsv1, rsv2 or rsv3 but no extensions '
-                        'were negotiated', extra
+                if data and not _is_valid_close_code(close_code):
+                    raise self.invalid_data(
+                        f'Received close frame with invalid close code {close_code}',
+                        WebSocketCloseCode.PROTOCOL_ERROR, fbyte, data
                     )
 
-            if frame.opcode in CONTROL_OPCODES:
-                if len(frame.data) > 125:
-                    extra['close_code'] = WebSocketCloseCode.PROTOCOL_ERROR
-                    raise ParserInvalidDataError(
-                        f'Received control frame with payload length > 125 '
-                        f'({len(frame.data)})', extra
+                try:
+                    codecs.utf_8_decode(data[2:], 'strict', True)
+                except UnicodeDecodeError as e:
+                    raise self.invalid_data(
+                        f'Received close frame with invalid reason: {e}',
+                        WebSocketCloseCode.INVALID_PAYLOAD_DATA, fbyte, data
                     )
 
-                elif not frame.fin:
-                    extra['close_code'] = WebSocketCloseCode.PROTOCOL_ERROR
-                    raise ParserInvalidDataError(
-                        'Received fragmented control frame', extra
+                self.close_received = True
+
+                if self.pending:
+                    self.add_pending(fbyte, opcode, None, (close_code, bytes(data[2:])), 0)
+                else:
+                    protocol.ws_close_received(close_code, data[2:])
+        else:
+            if opcode is WebSocketOpcode.CONTINUATION:
+                if self.fragmented_opcode is None:
+                    raise self.invalid_data(
+                        'Received continuation frame but there is no message to continue',
+                        WebSocketCloseCode.PROTOCOL_ERROR, fbyte, data
                     )
 
-                elif frame.opcode is WebSocketOpcode.PING:
-                    protocol.ws_ping_received(frame.data)
+                self.message_length += len(data)
 
-                elif frame.opcode is WebSocketOpcode.PONG:
-                    protocol.ws_pong_received(frame.data)
+            elif self.fragmented_opcode is not None:
+                raise self.invalid_data(
+                    f'Expected opcode {WebSocketOpcode.CONTINUATION} '
+                    f'(got {opcode})',
+                    WebSocketCloseCode.PROTOCOL_ERROR, fbyte, data
+                )
 
-                elif frame.opcode is WebSocketOpcode.CLOSE:
-                    close_clode = int.from_bytes(frame.data[:2], 'big')
-                    data = frame.data[2:]
-                    protocol.ws_close_received(close_clode, data)
             else:
-                if fragmented_frame is not None:
-                    if frame.opcode is not WebSocketOpcode.CONTINUATION:
-                        extra['close_code'] = WebSocketCloseCode.PROTOCOL_ERROR
-                        raise ParserInvalidDataError(
-                            f'Expected opcode {WebSocketOpcode.CONTINUATION} '
-                            f'(got {frame.opcode})',
-                            extra
-                        )
-                    else:
-                        fragment_buffer.extend(frame.data)
-                        if frame.fin:
-                            frame = fragmented_frame
-                            fragmented_frame = None
-                            frame.data = bytes(fragment_buffer)
-
-                elif not frame.fin:
-                    fragment_buffer.clear()
-                    fragment_buffer.extend(frame.data)
-                    fragmented_frame = frame
-
-                if frame.opcode is WebSocketOpcode.TEXT:
-                    try:
-                        string = frame.data.decode()
-                    except UnicodeDecodeError as e:
-                        extra['close_code'] = (
-                            WebSocketCloseCode.INVALID_PAYLOAD_DATA
+                self.compressed = rsv1
+                self.message_length = len(data)
+                self.message_size = 0
+
+                if opcode is WebSocketOpcode.TEXT and not fin:
+                    self.text_fragments = []
+                    self.text_remainder = b''
+
+            data = self.decompress(fbyte, data, fin)
+            self.message_size += len(data)
+
+            message_opcode = opcode
+
+            if opcode is WebSocketOpcode.CONTINUATION:
+                message_opcode = self.fragmented_opcode
+
+            string = None
+
+            if message_opcode is WebSocketOpcode.TEXT and (
+                self.streaming or not (fin and opcode is message_opcode)
+            ):
+                # Invalid fragments fail the connection before the rest of the
+                # message is received. Streamed messages are never decoded as
+                # a whole, so single frame ones are validated here as well.
+                string = self.decode_text(fbyte, data, fin)
+
+            if self.streaming:
+                self.fragmented_opcode = None if fin else message_opcode
+                protocol.ws_fragment_received(message_opcode, data, fin)
+                return
+
+            if string is not None:
+                if not fin:
+                    self.append_text(string, len(data))
+                    self.fragmented_opcode = message_opcode
+                    return
+
+                # The decoded fragments are joined instead of decoding the
+                # whole message again.
+                string = self.take_text(string)
+                self.fragmented_opcode = None
+
+                return self.message_received(fbyte, message_opcode, string)
+
+            elif opcode is WebSocketOpcode.CONTINUATION:
+                self.append_fragment(data)
+                if not fin:
+                    return
+
+                # The buffer is handed over instead of being copied again
+                opcode = self.fragmented_opcode
+                data = self.take_fragments()
+
+                self.fragmented_opcode = None
+
+            elif not fin:
+                self.append_fragment(data)
+                self.fragmented_opcode = opcode
+                return
+
+            self.message_received(fbyte, opcode, data)
+
+    def append_fragment(self, data):
+        # The fragments count towards the pool's inbound budget, the buffer
+        # itself is not borrowed since it is passed on as the message.
+        self.fragment_buffer.extend(data)
+
+        if self.buffer_pool is not None:
+            self.buffer_pool.charge(self.protocol, len(data))
+
+    def take_fragments(self):
+        data = self.fragment_buffer
+        self.fragment_buffer = bytearray()
+
+        if self.buffer_pool is not None:
+            self.buffer_pool.charge(self.protocol, -len(data))
+
+        return data
+
+    def append_text(self, string, size):
+        # Like append_fragment() for the decoded fragments of a text message
+        self.text_fragments.append(string)
+        self.text_size += size
+
+        if self.buffer_pool is not None:
+            self.buffer_pool.charge(self.protocol, size)
+
+    def take_text(self, last):
+        self.text_fragments.append(last)
+        string = ''.join(self.text_fragments)
+        self.text_fragments = []
+
+        if self.buffer_pool is not None and self.text_size:
+            self.buffer_pool.charge(self.protocol, -self.text_size)
+
+        self.text_size = 0
+
+        return string
+
+    def release(self):
+        # Called once the connection is lost
+        self.buffer.release()
+        self.fragment_buffer = bytearray()
+        self.text_fragments = []
+        self.text_size = 0
+
+        if self.buffer_pool is not None:
+            self.buffer_pool.forget(self.protocol)
+
+        # Messages sent before a clean close are still delivered
+        if not self.close_received:
+            self.drop_pending()
+
+    def add_pending(self, fbyte, opcode, future, data, size):
+        if self.pending is None:
+            self.pending = collections.deque()
+
+        self.pending.append((fbyte, opcode, future, data, size))
+        self.protocol._add_parser_pending(size, 1)
+
+    def drop_pending(self):
+        pending, self.pending = self.pending, None
+
+        if pending:
+            self.protocol._add_parser_pending(
+                -sum(entry[4] for entry in pending), -len(pending)
+            )
+
+            for entry in pending:
+                if entry[2] is not None:
+                    entry[2].cancel()
+
+            pending.clear()
+
+    def process_message(self, fbyte, opcode, data):
+        # Runs in the executor for offloaded messages
+        if self.serializer is not None and opcode is self.serializer.opcode:
+            try:
+                data = self.serializer.loads(data)
+            except Exception as e:
+                # Including invalid UTF-8 for the JSON serializers
+                raise self.invalid_data(
+                    f'Could not deserialize message: {e}',
+                    WebSocketCloseCode.INVALID_PAYLOAD_DATA, fbyte, b''
+                )
+
+        elif opcode is WebSocketOpcode.TEXT and not isinstance(data, str):
+            data = str(data, 'utf-8')
+
+        if self.transform is not None:
+            data = self.transform(opcode, data)
+
+        return data
+
+    def message_received(self, fbyte, opcode, data):
+        # data is the payload of a complete message, or the decoded string
+        # of a fragmented text message.
+        size = len(data)
+
+        if self.offload_threshold is not None and size >= self.offload_threshold:
+            return self.offload(fbyte, opcode, data)
+
+        try:
+            data = self.process_message(fbyte, opcode, data)
+        except UnicodeDecodeError as e:
+            raise self.invalid_data(str(e), WebSocketCloseCode.INVALID_PAYLOAD_DATA, fbyte, data)
+
+        if self.pending:
+            if isinstance(data, memoryview):
+                data = bytes(data)
+
+            self.add_pending(fbyte, opcode, None, data, size)
+        else:
+            self.deliver(opcode, data)
+
+    def deliver(self, opcode, data):
+        if opcode is WebSocketOpcode.CLOSE:
+            self.protocol.ws_close_received(*data)
+        elif self.serializer is not None and opcode is self.serializer.opcode:
+            self.protocol.ws_object_received(data)
+        elif opcode is WebSocketOpcode.TEXT:
+            self.protocol.ws_text_received(data)
+        else:
+            self.protocol.ws_binary_received(data)
+
+    def offload(self, fbyte, opcode, data):
+        if isinstance(data, memoryview):
+            data = bytes(data)
+
+        future = self.protocol.loop.run_in_executor(
+            self.executor, self.process_message, fbyte, opcode, data
+        )
+
+        self.add_pending(fbyte, opcode, future, None, len(data))
+        future.add_done_callback(self.offload_done)
+
+    def offload_done(self, future):
+        # Delivers every message at the front of the queue that is ready
+        pending = self.pending
+
+        while pending:
+            fbyte, opcode, future, data, size = pending[0]
+
+            if future is not None:
+                if not future.done():
+                    return
+
+                if future.cancelled():
+                    return self.drop_pending()
+
+                exc = future.exception()
+
+                if exc is not None:
+                    self.drop_pending()
+
+                    if isinstance(exc, UnicodeDecodeError):
+                        exc = self.invalid_data(
+                            str(exc), WebSocketCloseCode.INVALID_PAYLOAD_DATA, fbyte, b''
                         )
-                        raise ParserInvalidDataError(str(e), extra)
 
-                    protocol.ws_text_received(string)
+                    return self.protocol._run_callback('parser_failed', exc)
+
+                data = future.result()
 
-                elif frame.opcode is WebSocketOpcode.BINARY:
-                    protocol.ws_binary_received(frame.data)
+            pending.popleft()
+            self.protocol._add_parser_pending(-size, -1)
+            self.deliver(opcode, data)